@@ -1,3 +1,5 @@
+import asyncio
+
 from admin_interface.admin import ThemeAdmin
 from admin_interface.models import Theme
 from django.contrib import admin
@@ -116,11 +118,14 @@ class VideoGenerationAdmin(admin.ModelAdmin):
         "client",
         "task_id",
         "status",
+        "model",
         "coins_charged",
+        "poll_attempts",
+        "delivered_at",
         "created",
     )
     list_display_links = ("pk", "task_id")
-    list_filter = ("status", ChargedFilter, "created")
+    list_filter = ("status", "model", ChargedFilter, "created")
     search_fields = (
         "client__username",
         "client__telegram_id",
@@ -128,7 +133,7 @@ class VideoGenerationAdmin(admin.ModelAdmin):
     )
     empty_value_display = "-пусто-"
     readonly_fields = ("created", "updated")
-    actions = ("refund_failed",)
+    actions = ("refund_failed", "resend_video")
     list_select_related = ("client",)
     date_hierarchy = "created"
 
@@ -147,6 +152,36 @@ class VideoGenerationAdmin(admin.ModelAdmin):
 
     refund_failed.short_description = "Вернуть монеты за failed"
 
+    def resend_video(self, request, queryset):
+        from aiogram import Bot
+        from tgbot.config import load_config
+        from tgbot.misc.tasks import send_video_cached
+
+        async def _send(videos):
+            config = load_config(".env")
+            bot = Bot(token=config.tg_bot.token, parse_mode='HTML')
+            sent = 0
+            try:
+                for vg in videos:
+                    try:
+                        await send_video_cached(bot, vg, vg.client.telegram_id, f"Ваше видео. Ссылка: {vg.result_url}")
+                        sent += 1
+                    except Exception:
+                        continue
+            finally:
+                await bot.session.close()
+            return sent
+
+        videos = list(queryset.select_related("client").filter(status="completed").exclude(result_url__isnull=True))
+        loop = asyncio.new_event_loop()
+        try:
+            sent = loop.run_until_complete(_send(videos))
+        finally:
+            loop.close()
+        self.message_user(request, f"Отправлено видео: {sent}")
+
+    resend_video.short_description = "Отправить видео повторно"
+
 
 class HasExternalIDFilter(admin.SimpleListFilter):
     title = "Есть external ID"
@@ -87,12 +87,16 @@ class VideoGeneration(CreatedModel):
         max_length=255,
         verbose_name="File ID видео",
         help_text="File ID сгенерированного видео",
+        null=True,
+        blank=True,
     )
     status = models.CharField(
         max_length=50,
         verbose_name="Статус",
         help_text="Статус генерации видео",
         choices=[
+            ("queued", "В очереди"),
+            ("submitting", "Отправляется"),
             ("in_progress", "В процессе"),
             ("completed", "Завершено"),
             ("failed", "Не удалось"),
@@ -122,11 +126,149 @@ class VideoGeneration(CreatedModel):
         verbose_name="Списано монет",
         help_text="Сколько монет списано за это видео"
     )
+    model = models.CharField(
+        max_length=50,
+        verbose_name="Модель",
+        help_text="Модель генерации видео",
+        choices=[
+            ("veo3_fast", "Fast version"),
+            ("veo3", "Ultra version"),
+        ],
+        default="veo3",
+    )
+    request_key = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name="Ключ запроса",
+        help_text="Ключ идемпотентности отправки в kie.ai (передаётся в callBackUrl)",
+        null=True,
+        blank=True,
+    )
+    submitted_at = models.DateTimeField(
+        verbose_name="Отправлено в kie.ai",
+        null=True,
+        blank=True,
+    )
+    prompt = models.TextField(
+        verbose_name="Промпт пользователя",
+        null=True,
+        blank=True,
+    )
+    adapted_prompt = models.TextField(
+        verbose_name="Адаптированный промпт",
+        null=True,
+        blank=True,
+    )
+    image_url = models.URLField(
+        max_length=1000,
+        verbose_name="Ссылка на фото",
+        help_text="Загруженное на kie.ai изображение для генерации",
+        null=True,
+        blank=True,
+    )
+    aspect_ratio = models.CharField(
+        max_length=10,
+        verbose_name="Соотношение сторон",
+        choices=[
+            ("16:9", "16:9"),
+            ("9:16", "9:16"),
+        ],
+        default="16:9",
+    )
+    completed_at = models.DateTimeField(
+        verbose_name="Готово",
+        help_text="Когда kie.ai сообщил о готовности видео",
+        null=True,
+        blank=True,
+    )
+    generation_seconds = models.FloatField(
+        verbose_name="Длительность генерации, сек",
+        help_text="По времени самого kie.ai (createTime/completeTime или приход колбэка), без задержки опроса",
+        null=True,
+        blank=True,
+    )
+    next_poll_at = models.DateTimeField(
+        verbose_name="Следующая проверка статуса",
+        help_text="Когда опросить статус задачи в следующий раз",
+        null=True,
+        blank=True,
+    )
+    poll_attempts = models.IntegerField(
+        default=0,
+        verbose_name="Проверок статуса",
+        help_text="Сколько раз статус задачи уже проверялся"
+    )
+    delivery_attempts = models.IntegerField(
+        default=0,
+        verbose_name="Попыток доставки",
+        help_text="Сколько раз пытались отправить готовое видео пользователю"
+    )
+    delivery_error = models.TextField(
+        verbose_name="Ошибка доставки",
+        help_text="Последняя ошибка при отправке видео в Telegram",
+        null=True,
+        blank=True,
+    )
+    delivered_at = models.DateTimeField(
+        verbose_name="Доставлено",
+        help_text="Когда видео отправлено пользователю",
+        null=True,
+        blank=True,
+    )
+    tg_file_id = models.CharField(
+        max_length=255,
+        verbose_name="Telegram file_id",
+        help_text="file_id видео в Telegram для повторных отправок без скачивания",
+        null=True,
+        blank=True,
+    )
+    tg_file_unique_id = models.CharField(
+        max_length=64,
+        verbose_name="Telegram file_unique_id",
+        null=True,
+        blank=True,
+    )
+    lease_owner = models.CharField(
+        max_length=128,
+        verbose_name="Обработчик",
+        help_text="Экземпляр бота (host:pid), который сейчас обрабатывает задачу",
+        null=True,
+        blank=True,
+    )
+    lease_expires_at = models.DateTimeField(
+        verbose_name="Аренда до",
+        help_text="После этого момента задачу может забрать другой экземпляр бота",
+        null=True,
+        blank=True,
+    )
 
     class Meta:
         verbose_name = "Генерация видео"
         verbose_name_plural = "Генерации видео"
         ordering = ("-created",)
+        indexes = [
+            # Частичные индексы под фоновые опросы: в них попадает только малая часть строк
+            models.Index(
+                fields=["next_poll_at"],
+                condition=models.Q(status="in_progress"),
+                name="videogen_inprogress_poll_idx",
+            ),
+            models.Index(
+                fields=["next_poll_at"],
+                condition=models.Q(status="completed", delivered_at__isnull=True),
+                name="videogen_undelivered_idx",
+            ),
+            models.Index(
+                fields=["created"],
+                condition=models.Q(status="queued"),
+                name="videogen_queued_idx",
+            ),
+            models.Index(
+                fields=["next_poll_at"],
+                condition=models.Q(status="submitting"),
+                name="videogen_submitting_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"VideoGeneration {self.id} for {self.client}"
@@ -165,6 +307,9 @@ class Payment(CreatedModel):
         verbose_name = "Платёж"
         verbose_name_plural = "Платежи"
         ordering = ("-created",)
+        indexes = [
+            models.Index(fields=["id"], condition=models.Q(status="pending"), name="payment_pending_idx"),
+        ]
 
     def __str__(self):
         return f"Payment {self.id} {self.method} {self.status}"
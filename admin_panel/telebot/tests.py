@@ -0,0 +1,106 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from admin_panel.telebot.models import Client, Payment, VideoGeneration
+from tgbot.misc.prompt_index import PromptIndex
+from tgbot.models.db_commands import claim_due_videos, select_pending_payments
+
+
+class PollCycleQueriesTest(TestCase):
+    """
+    Число запросов за цикл опроса не зависит от количества задач и платежей
+    """
+
+    def _create_videos(self, count):
+        past = timezone.now() - timedelta(minutes=1)
+        for i in range(count):
+            client = Client.objects.create(telegram_id=1000 + i, name=f"user{i}", url=f"https://t.me/user{i}")
+            VideoGeneration.objects.create(client=client, task_id=f"task{i}", status="in_progress", next_poll_at=past)
+
+    def _create_payments(self, count):
+        for i in range(count):
+            client = Client.objects.create(telegram_id=2000 + i, name=f"payer{i}", url=f"https://t.me/payer{i}")
+            Payment.objects.create(
+                client=client, method="yookassa", coins_requested=100, amount_rub=Decimal("100"),
+                external_id=f"pay{i}",
+            )
+
+    def _claim_queries(self, worker_id):
+        with CaptureQueriesContext(connection) as ctx:
+            videos = async_to_sync(claim_due_videos)(worker_id, 60, 100)
+            # Обработка результата обращается к клиенту — это не должно давать запрос на каждую задачу
+            chat_ids = [video.client.telegram_id for video in videos]
+        return len(videos), len(chat_ids), len(ctx.captured_queries)
+
+    def _payments_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            payments = async_to_sync(select_pending_payments)()
+            fields = [(p.client_id, p.method, p.status, p.external_id) for p in payments]
+        return len(fields), len(ctx.captured_queries)
+
+    def test_claim_due_videos_query_count_is_constant(self):
+        self._create_videos(1)
+        claimed, delivered, small = self._claim_queries("worker-a")
+        self.assertEqual((claimed, delivered), (1, 1))
+
+        self._create_videos(20)
+        claimed, delivered, large = self._claim_queries("worker-b")
+        self.assertEqual((claimed, delivered), (20, 20))
+        self.assertEqual(small, large)
+        # SAVEPOINT, выборка id, UPDATE аренды, RELEASE, выборка задач вместе с клиентами
+        self.assertEqual(large, 5)
+
+    def test_claim_due_videos_skips_leased(self):
+        self._create_videos(3)
+        self.assertEqual(self._claim_queries("worker-a")[0], 3)
+        self.assertEqual(self._claim_queries("worker-b")[0], 0)
+
+    def test_select_pending_payments_single_query(self):
+        self._create_payments(1)
+        fetched, small = self._payments_queries()
+        self.assertEqual(fetched, 1)
+        self.assertEqual(small, 1)
+
+        self._create_payments(20)
+        fetched, large = self._payments_queries()
+        self.assertEqual(fetched, 21)
+        self.assertEqual(large, 1)
+
+
+class PromptIndexTest(SimpleTestCase):
+    """
+    Готовая адаптация переиспользуется только для того же содержания, а не для похожего текста
+    """
+
+    PROMPT = (
+        "Рыжий кот медленно идёт по мокрой крыше старого дома под проливным дождём, камера плавно "
+        "облетает его сбоку, вдалеке мерцают огни ночного города, кинематографичный свет, "
+        "мягкая глубина резкости, атмосфера спокойной меланхолии, реалистичная фактура шерсти"
+    )
+
+    def setUp(self):
+        self.index = PromptIndex()
+        self.index.add(self.PROMPT, "adapted")
+
+    def test_same_prompt_after_normalisation_hits(self):
+        match = self.index.lookup("  " + self.PROMPT.upper().replace(",", " ;") + "!")
+        self.assertIsNotNone(match)
+        self.assertEqual(match.adapted, "adapted")
+
+    def test_changed_subject_misses(self):
+        self.assertIsNone(self.index.lookup(self.PROMPT.replace("кот", "пёс")))
+
+    def test_changed_scene_detail_misses(self):
+        self.assertIsNone(self.index.lookup(self.PROMPT.replace("дождём", "снегом")))
+
+    def test_changed_colour_misses(self):
+        self.assertIsNone(self.index.lookup(self.PROMPT.replace("Рыжий", "Серый")))
+
+    def test_swapped_words_miss(self):
+        self.assertIsNone(self.index.lookup(self.PROMPT.replace("мокрой крыше старого", "старой крыше мокрого")))
@@ -23,10 +23,21 @@ logger = logging.getLogger(__name__)
 
 
 def scheduler_jobs(bot, config):
-    from tgbot.misc.tasks import send_user_video, check_pending_payments
+    from tgbot.misc.tasks import send_user_video, check_pending_payments, log_http_pool_stats, purge_blobs, \
+        save_eta_stats, dispatch_video_queue, reconcile_submissions
     from tgbot.misc.mailing import start_milling
 
-    config.misc.scheduler.add_job(send_user_video, "interval", minutes=1,
+    config.misc.scheduler.add_job(send_user_video, "interval", seconds=config.video.poll_interval,
+                                  kwargs={
+                                      'bot': bot,
+                                      'config': config
+                                  })
+    config.misc.scheduler.add_job(dispatch_video_queue, "interval", seconds=config.video.dispatch_interval,
+                                  kwargs={
+                                      'bot': bot,
+                                      'config': config
+                                  })
+    config.misc.scheduler.add_job(reconcile_submissions, "interval", minutes=1,
                                   kwargs={
                                       'bot': bot,
                                       'config': config
@@ -44,13 +55,52 @@ def scheduler_jobs(bot, config):
                                       'bot': bot
 
                                   })
+    config.misc.scheduler.add_job(log_http_pool_stats, "interval", minutes=10,
+                                  kwargs={
+                                      'config': config
+                                  })
+    config.misc.scheduler.add_job(purge_blobs, "interval", minutes=30,
+                                  kwargs={
+                                      'config': config
+                                  })
+    config.misc.scheduler.add_job(save_eta_stats, "interval", minutes=5,
+                                  kwargs={
+                                      'config': config
+                                  })
 
 
 async def on_startup(bot: Bot, admin_ids: list[int], config):
     await set_commands(bot)
     configure_logger(True)
+    await config.tg_bot.veo_svc.start()
+    await config.tg_bot.gpt_svc.start()
+    from tgbot.misc.tasks import load_eta_stats, load_prompt_index
+    await load_eta_stats(config)
+    await load_prompt_index(config)
+    if not config.tg_bot.veo_svc.callback_url:
+        logger.warning("kie.ai webhook is disabled: unconfirmed video submissions are refunded immediately "
+                       "and may still produce a video on kie.ai")
+    webhook_server = None
+    if config.webhook.enabled:
+        from tgbot.services.kie_webhook import KieWebhookServer
+        webhook_server = KieWebhookServer(
+            bot, config.webhook.host, config.webhook.port, config.webhook.secret, admin_ids
+        )
+        await webhook_server.start()
     await broadcaster.broadcast(bot, admin_ids, "Бот запущен")
     scheduler_jobs(bot, config)
+    return webhook_server
+
+
+async def on_shutdown(config, webhook_server=None):
+    if webhook_server is not None:
+        await webhook_server.stop()
+    logger.info(f"Veo HTTP pool stats: {config.tg_bot.veo_svc.pool_stats()}")
+    await config.tg_bot.veo_svc.close()
+    await config.tg_bot.gpt_svc.close()
+    config.tg_bot.image_prep.shutdown()
+    from tgbot.misc.tasks import save_eta_stats
+    await save_eta_stats(config)
 
 
 def register_global_middlewares(dp: Dispatcher, config):
@@ -91,8 +141,12 @@ async def main():
     from tgbot.handlers.chat_gpt import chat_router
     from tgbot.handlers.balance import balance_router
     from tgbot.handlers.referral import referral_router
+    from tgbot.handlers.admin import admin_router
 
-    for router in [user_router, video_router, chat_router, balance_router, referral_router, echo_router]:
+    # Команды администратора — раньше роутеров с состояниями: иначе, например, в режиме вопроса ChatGPT
+    # /reload_prompts уйдёт в чат как вопрос. user_router остаётся первым, /start у всех общий
+    for router in [user_router, admin_router, video_router, chat_router, balance_router, referral_router,
+                   echo_router]:
         dp.include_router(router)
 
     register_global_middlewares(dp, config)
@@ -103,8 +157,11 @@ async def main():
 
     await create_super_user(config.misc.super_user_name, config.misc.super_user_pass)
 
-    await on_startup(bot, config.tg_bot.admin_ids, config)
-    await dp.start_polling(bot)
+    webhook_server = await on_startup(bot, config.tg_bot.admin_ids, config)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await on_shutdown(config, webhook_server)
 
 
 if __name__ == "__main__":
@@ -1,13 +1,20 @@
 # tgbot/config.py
 from dataclasses import dataclass
+from aiohttp import ClientTimeout
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from environs import Env
+from environs import Env, EnvError
 
 from tgbot.services.video_generate import VideoGeneratorService
 from tgbot.services.chat_gpt import ChatGPTService
+from tgbot.services.answer_cache import AnswerCache
+from tgbot.services.kie_webhook import CALLBACK_PATH
 from tgbot.services.yookassa_service import YandexKassaService
 from tgbot.services.cryptobot_service import CryptoBotService
 from tgbot.services.stars_service import StarsPaymentService
+from tgbot.services.blob_store import LocalBlobStore, RedisBlobStore
+from tgbot.services.image_prepare import ImagePreprocessor
+from tgbot.misc.resilience import CircuitBreaker, RedisTokenBucket, TokenBucket
+from tgbot.misc.prompt_index import PromptIndex
 from admin_panel.config import config as main_config
 
 
@@ -37,6 +44,9 @@ class TgBot:
     yookassa_svc: YandexKassaService | None
     cryptobot_svc: CryptoBotService | None
     stars_svc: StarsPaymentService | None
+    blob_store: LocalBlobStore | RedisBlobStore
+    image_prep: ImagePreprocessor
+    answer_cache: AnswerCache
 
 
 @dataclass
@@ -47,12 +57,52 @@ class Miscellaneous:
     super_user_pass: str
 
 
+@dataclass
+class VideoJobs:
+    poll_concurrency: int
+    poll_interval: int
+    distinct_prompts: bool
+    submit_concurrency: int
+    lease_seconds: int
+    claim_batch: int
+    eta_file: str
+    max_in_flight: int
+    max_in_flight_per_user: int
+    dispatch_interval: int
+    submit_reconcile: int
+    max_generation_age: int
+
+
+@dataclass
+class Chat:
+    stream_edit_interval: float
+
+
+@dataclass
+class Webhook:
+    enabled: bool
+    host: str
+    port: int
+    public_url: str
+    secret: str
+    poll_grace: int
+
+
 @dataclass
 class Config:
     tg_bot: TgBot
     db: DbConfig
     misc: Miscellaneous
     redis: Redis
+    video: VideoJobs
+    webhook: Webhook
+    chat: Chat
+
+
+def _client_timeout(env: Env, name: str, default: list) -> ClientTimeout:
+    # Формат: "connect,sock_read,total" в секундах
+    connect, sock_read, total = env.list(name, default, subcast=float)
+    return ClientTimeout(total=total, connect=connect, sock_read=sock_read)
 
 
 def load_config(path: str = None):
@@ -73,6 +123,48 @@ def load_config(path: str = None):
         star_rub=main_config.MainConfig.TG_STARS_RATE_RUB,
     )
 
+    webhook = Webhook(
+        enabled=env.bool("KIE_WEBHOOK_ENABLED", False),
+        host=env.str("KIE_WEBHOOK_HOST", "0.0.0.0"),
+        port=env.int("KIE_WEBHOOK_PORT", 8081),
+        public_url=env.str("KIE_WEBHOOK_PUBLIC_URL", ""),
+        secret=env.str("KIE_WEBHOOK_SECRET", ""),
+        poll_grace=env.int("KIE_WEBHOOK_POLL_GRACE", 300),
+    )
+    if webhook.enabled and not (webhook.public_url and webhook.secret):
+        # Без адреса колбэк не запрашивается, без секрета сервер отвечает 403 на каждый колбэк
+        raise EnvError("KIE_WEBHOOK_ENABLED requires KIE_WEBHOOK_PUBLIC_URL and KIE_WEBHOOK_SECRET")
+    blob_ttl = env.int("BLOB_TTL", 3600)
+    generate_rate = (env.float("KIE_GENERATE_RATE", 2), env.int("KIE_GENERATE_BURST", 20))
+    status_rate = (env.float("KIE_STATUS_RATE", 10), env.int("KIE_STATUS_BURST", 20))
+    answer_cache = AnswerCache(
+        maxsize=env.int("CHAT_CACHE_SIZE", 2048),
+        ttl=env.int("CHAT_CACHE_TTL", 24 * 3600),
+    )
+    if env.bool("USE_REDIS"):
+        from aioredis import Redis as RedisClient
+        blob_store = RedisBlobStore(
+            RedisClient(
+                host=env.str("REDIS_HOST"),
+                port=env.int("REDIS_PORT"),
+                db=env.str("REDIS_DB_BLOBS", env.str("REDIS_DB_FSM")),
+            ),
+            ttl=blob_ttl,
+        )
+        # Бюджет запросов к kie.ai общий для всех экземпляров бота
+        generate_limiter = RedisTokenBucket(blob_store.redis, "ratelimit:kie:generate", *generate_rate)
+        status_limiter = RedisTokenBucket(blob_store.redis, "ratelimit:kie:status", *status_rate)
+        # Ответы ChatGPT тоже общие: вопрос, заданный на одном экземпляре, не оплачивается повторно на другом
+        answer_cache.redis = blob_store.redis
+    else:
+        blob_store = LocalBlobStore(env.str("BLOB_DIR", "/tmp/tgbot_blobs"), ttl=blob_ttl)
+        generate_limiter = TokenBucket(*generate_rate)
+        status_limiter = TokenBucket(*status_rate)
+
+    callback_url = None
+    if webhook.enabled:
+        callback_url = f"{webhook.public_url.rstrip('/')}{CALLBACK_PATH}?token={webhook.secret}"
+
     return Config(
         tg_bot=TgBot(
             token=env.str("BOT_TOKEN"),
@@ -82,11 +174,49 @@ def load_config(path: str = None):
                 prompt_file=env.str("PROMPT_FILE"),
                 prompt_api_key=main_config.MainConfig.OPENROUTER_API_KEY,
                 video_api_token=main_config.MainConfig.VEO_API_KEY,
+                pool_limit=env.int("VEO_POOL_LIMIT", 100),
+                pool_limit_per_host=env.int("VEO_POOL_LIMIT_PER_HOST", 20),
+                api_base=env.str("KIE_API_BASE", "https://api.kie.ai"),
+                upload_base=env.str("KIE_UPLOAD_BASE", "https://kieai.redpandaai.co"),
+                callback_url=callback_url,
+                upload_mode=env.str("KIE_UPLOAD_MODE", "stream"),
+                generate_limiter=generate_limiter,
+                status_limiter=status_limiter,
+                breaker=CircuitBreaker(
+                    "kie.ai",
+                    failure_threshold=env.int("KIE_BREAKER_FAILURES", 5),
+                    recovery_timeout=env.int("KIE_BREAKER_RESET", 30),
+                ),
+                timeouts={
+                    "upload": _client_timeout(env, "KIE_UPLOAD_TIMEOUT", [10, 60, 120]),
+                    "generate": _client_timeout(env, "KIE_GENERATE_TIMEOUT", [10, 25, 30]),
+                    "status": _client_timeout(env, "KIE_STATUS_TIMEOUT", [5, 10, 15]),
+                },
+                hedge_status=env.bool("KIE_STATUS_HEDGE", False),
+                prompt_index=PromptIndex(
+                    maxsize=env.int("PROMPT_INDEX_SIZE", 2000),
+                    threshold=env.float("PROMPT_INDEX_THRESHOLD", 0.95),
+                ) if env.bool("PROMPT_INDEX_ENABLED", True) else None,
+                # Дополнительные именованные шаблоны: "name=path,name2=path2"
+                prompt_templates=env.dict("PROMPT_TEMPLATES", {}),
+                template_check_interval=env.float("PROMPT_RELOAD_INTERVAL", 5),
+            ),
+            gpt_svc=ChatGPTService(
+                api_key=main_config.MainConfig.OPENAI_API_KEY,
+                pool_limit=env.int("GPT_POOL_LIMIT", 50),
+                pool_limit_per_host=env.int("GPT_POOL_LIMIT_PER_HOST", 20),
+                stream_idle_timeout=env.int("GPT_STREAM_IDLE_TIMEOUT", 30),
             ),
-            gpt_svc=ChatGPTService(api_key=main_config.MainConfig.OPENAI_API_KEY),
             yookassa_svc=yookassa,
             cryptobot_svc=cryptobot,
             stars_svc=stars,
+            blob_store=blob_store,
+            image_prep=ImagePreprocessor(
+                image_format=env.str("IMAGE_FORMAT", "JPEG"),
+                quality=env.int("IMAGE_QUALITY", 85),
+                max_workers=env.int("IMAGE_WORKERS", 2),
+            ),
+            answer_cache=answer_cache,
         ),
         db=DbConfig(
             host=env.str("DB_HOST"),
@@ -106,4 +236,22 @@ def load_config(path: str = None):
             db_fsm=env.str("REDIS_DB_FSM"),
             job_store=env.str("REDIS_DB_JOBSTORE"),
         ),
+        video=VideoJobs(
+            poll_concurrency=env.int("VIDEO_POLL_CONCURRENCY", 20),
+            poll_interval=env.int("VIDEO_POLL_INTERVAL", 15),
+            distinct_prompts=env.bool("VIDEO_DISTINCT_PROMPTS", False),
+            submit_concurrency=env.int("VIDEO_SUBMIT_CONCURRENCY", 3),
+            lease_seconds=env.int("VIDEO_LEASE_SECONDS", 300),
+            claim_batch=env.int("VIDEO_CLAIM_BATCH", 200),
+            eta_file=env.str("VIDEO_ETA_FILE", "logs/eta_stats.json"),
+            max_in_flight=env.int("VIDEO_MAX_IN_FLIGHT", 50),
+            max_in_flight_per_user=env.int("VIDEO_MAX_IN_FLIGHT_PER_USER", 3),
+            dispatch_interval=env.int("VIDEO_DISPATCH_INTERVAL", 5),
+            submit_reconcile=env.int("VIDEO_SUBMIT_RECONCILE", 1800),
+            max_generation_age=env.int("VIDEO_MAX_GENERATION_AGE", 2 * 3600),
+        ),
+        webhook=webhook,
+        chat=Chat(
+            stream_edit_interval=env.int("CHAT_STREAM_EDIT_MS", 1000) / 1000,
+        ),
     )
@@ -2,6 +2,7 @@ from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
 
+from tgbot.config import Config
 from tgbot.filters.admin import AdminFilter
 
 admin_router = Router()
@@ -11,3 +12,13 @@ admin_router.message.filter(AdminFilter())
 @admin_router.message(Command(commands=["start"]))
 async def admin_start(message: Message):
     await message.reply("Вы админ")
+
+
+@admin_router.message(Command(commands=["reload_prompts"]))
+async def admin_reload_prompts(message: Message, config: Config):
+    """
+    Перечитать шаблоны промптов с диска, не дожидаясь проверки mtime.
+    """
+    result = config.tg_bot.veo_svc.prompt_service.reload_templates()
+    lines = [f"{'✅' if ok else '⚠️'} {name}" for name, ok in result.items()]
+    await message.reply("Шаблоны промптов перечитаны:\n" + "\n".join(lines), parse_mode=None)
@@ -6,42 +6,12 @@ from aiogram.types import CallbackQuery, Message
 
 from tgbot.config import Config
 from tgbot.keyboards.inline import back_to_menu_kb
+from tgbot.misc.message_stream import ThrottledMessageEditor, split_long
 from tgbot.misc.states import ChatStates
 from tgbot.models.db_commands import select_client
 
 chat_router = Router()
 
-MAX_TG_LEN = 4096
-SAFE_SPLIT = 4000  # запас
-
-
-def split_long(text: str):
-    if len(text) <= MAX_TG_LEN:
-        return [text]
-    parts = []
-    current = []
-    current_len = 0
-    for line in text.splitlines(keepends=True):
-        if current_len + len(line) > SAFE_SPLIT:
-            parts.append("".join(current))
-            current = [line]
-            current_len = len(line)
-        else:
-            current.append(line)
-            current_len += len(line)
-    if current:
-        parts.append("".join(current))
-    # Дополнительное дробление очень длинных без переносов
-    final = []
-    for p in parts:
-        if len(p) <= MAX_TG_LEN:
-            final.append(p)
-        else:
-            for i in range(0, len(p), SAFE_SPLIT):
-                final.append(p[i:i + SAFE_SPLIT])
-    return final
-
-
 @chat_router.callback_query(F.data == "free_chatgpt")
 async def free_chat_start(call: CallbackQuery, state: FSMContext):
     client = await select_client(call.message.chat.id)
@@ -66,6 +36,21 @@ async def free_chat_ask(message: Message, config: Config):
     client = await select_client(message.chat.id)
     today = date.today()
     client.ensure_free_chat_quota(today)
+
+    # Готовый ответ на такой же вопрос отдаём сразу и без списания бесплатного запроса
+    cached = await config.tg_bot.answer_cache.get(question)
+    if cached is not None:
+        chunks = split_long(cached)
+        await message.reply(chunks[0], parse_mode=None)
+        for extra in chunks[1:]:
+            await message.answer(extra, parse_mode=None)
+        remaining = max(0, client.free_chat_daily_limit - client.free_chat_used_today)
+        await message.answer(
+            f"Осталось бесплатных запросов сегодня: {remaining}. Можете задать следующий вопрос.",
+            reply_markup=await back_to_menu_kb()
+        )
+        return
+
     if not client.has_free_chat_quota():
         remaining = 0
         await message.reply(
@@ -76,26 +61,34 @@ async def free_chat_ask(message: Message, config: Config):
 
     thinking_msg = await message.reply("Думаю над ответом ...")
 
+    # Ответ показываем по мере генерации, правки сообщения — не чаще раза в stream_edit_interval
+    editor = ThrottledMessageEditor(thinking_msg, interval=config.chat.stream_edit_interval)
+    parts = []
     try:
-        answer = await config.tg_bot.gpt_svc.ask(question=question)
+        async for delta in config.tg_bot.gpt_svc.ask_stream(question=question):
+            parts.append(delta)
+            await editor.update("".join(parts))
     except Exception as e:
+        if parts:
+            await editor.finish("".join(parts) + f"\n\n⚠️ Ответ прерван: {e}")
+            return
         try:
             await thinking_msg.edit_text(f"Ошибка: {e}")
         except:
             await message.reply(f"Ошибка: {e}")
         return
 
+    answer = "".join(parts)
+    if not answer.strip():
+        await thinking_msg.edit_text("Пустой ответ от модели, попробуйте переформулировать вопрос.")
+        return
+
     # Учет квоты
     client.inc_free_chat_usage()
     client.save()
+    await config.tg_bot.answer_cache.set(question, answer)
 
-    chunks = split_long(answer)
-    try:
-        await thinking_msg.edit_text(chunks[0])
-    except:
-        await message.reply(chunks[0])
-    for extra in chunks[1:]:
-        await message.answer(extra)
+    await editor.finish(answer)
 
     remaining = client.free_chat_daily_limit - client.free_chat_used_today
     await message.answer(
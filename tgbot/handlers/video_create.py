@@ -1,19 +1,23 @@
 import uuid
 from io import BytesIO
 from pathlib import Path
-from typing import Union
+from typing import Optional, Union
 
 from aiogram import Router, F
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from loguru import logger
 
-from admin_panel.telebot.models import Client, VideoGeneration
+from admin_panel.telebot.models import Client
 from tgbot.config import Config
 from tgbot.keyboards.inline import video_format_kb, side_orientation_kb, back_to_menu_kb, wait_photo_kb, video_count_kb, \
     back_to_choice_format_kb, back_to_side_kb
+from tgbot.misc.eta import generation_eta
+from tgbot.misc.speculative import speculative_prompts, speculative_uploads
 from tgbot.misc.states import States
-from tgbot.models.db_commands import AsyncDatabaseOperations, select_client
+from tgbot.misc.tasks import dispatch_video_queue, request_key, video_cost
+from tgbot.models.db_commands import select_client, enqueue_videos
+from tgbot.services.video_generate import MAX_VIDEOS_PER_ORDER
 from admin_panel.config import config as main_config
 
 video_router = Router()
@@ -34,6 +38,8 @@ async def start_generate_video(call: CallbackQuery):
 async def choose_video_format(call: CallbackQuery, state: FSMContext):
     model_type = 'veo3_fast' if call.data == 'fast_version' else 'veo3'
     await state.update_data(model_type=model_type)
+    # Время генерации — по фактической статистике последних роликов
+    eta_text = generation_eta.range_text(model_type)
     text_fast = (
         "💡 Fast version — быстро и дёшево (до 5 сек, без озвучки).\n\n"
         "⚙️ Характеристики:\n"
@@ -41,7 +47,7 @@ async def choose_video_format(call: CallbackQuery, state: FSMContext):
         "• Длительность: до 8 секунд\n"
         "• Поддержка озвучки (стандартная)\n"
         "• Загрузка фото: до 1 изображения\n"
-        "• Время генерации: 3–5 минут\n"
+        f"• Время генерации: {eta_text}\n"
         "• Качество: улучшенное\n\n"
         "📝 Выбор соотношения сторон: 16:9 или 9:16"
     )
@@ -52,7 +58,7 @@ async def choose_video_format(call: CallbackQuery, state: FSMContext):
         "• Длительность: до 8 сек\n"
         "• Озвучка: улучшенная\n"
         "• Фото: 1 изображение\n"
-        "• Время генерации: 5–7 мин\n"
+        f"• Время генерации: {eta_text}\n"
         "📝 Выбор соотношения сторон: 16:9 или 9:16"
     )
     await call.message.edit_text(text=text_fast if call.data == 'fast_version' else text_ultra,
@@ -63,6 +69,8 @@ async def choose_video_format(call: CallbackQuery, state: FSMContext):
 @video_router.callback_query(F.data == "side_9_16")
 async def choose_side_orientation(call: CallbackQuery, state: FSMContext):
     side_orientation = '16:9' if call.data == 'side_16_9' else '9:16'
+    # Пользователь вернулся к вводу текста — заранее начатая адаптация старого промпта не нужна
+    speculative_prompts.cancel(call.message.chat.id)
     await state.update_data(side_orientation=side_orientation)
     data = await state.get_data()
     await state.set_state(States.prompt)
@@ -91,6 +99,7 @@ async def prompt_received(message: Message, state: FSMContext, config: Config):
             await message.answer(f"Ошибка распознавания: {e}")
             return
         await state.update_data(prompt=text)
+        _speculate_prompt(message.chat.id, text, config)
         await message.answer(f"Распознанный текст:\n{text}\nТеперь отправьте фото.",
                              reply_markup=await back_to_side_kb(data.get("side_orientation")))
     else:
@@ -99,19 +108,33 @@ async def prompt_received(message: Message, state: FSMContext, config: Config):
                                  await back_to_choice_format_kb(data.get("model_type")))
             return
         await state.update_data(prompt=message.text[:500])
+        _speculate_prompt(message.chat.id, message.text[:500], config)
     await message.answer("✨ Отлично, текст получен!\n\n📷 Прикрепите фото (или нажмите «Пропустить»).",
                          reply_markup=await wait_photo_kb(data.get("side_orientation")))
     await state.set_state(States.photo)
 
 
+def _speculate_prompt(chat_id: int, prompt: str, config: Config):
+    """
+    Адаптация промпта стартует в фоне сразу после ввода текста, пока пользователь выбирает фото и количество.
+    """
+    distinct = config.video.distinct_prompts
+    speculative_prompts.start(
+        chat_id,
+        (prompt, distinct),
+        lambda: config.tg_bot.veo_svc.adapt_prompts(prompt, MAX_VIDEOS_PER_ORDER, distinct=distinct),
+    )
+
+
 @video_router.message(States.photo, F.photo)
 @video_router.callback_query(States.photo, F.data == "skip_photo")
-async def receive_photo(event: Union[Message, CallbackQuery], state: FSMContext):
+async def receive_photo(event: Union[Message, CallbackQuery], state: FSMContext, config: Config):
     # Пропуск фото
     data_state = await state.get_data()
     if isinstance(event, CallbackQuery):
         await event.message.delete()
-        await state.update_data(photo_bytes=None, photo_filename=None, photo_mime=None)
+        speculative_uploads.cancel(event.message.chat.id)
+        await state.update_data(photo_filename=None, photo_mime=None, photo_key=None)
         await event.message.answer("✨ Сколько роликов создать для вас?",
                                    reply_markup=await video_count_kb(data_state.get("side_orientation")))
         return
@@ -125,16 +148,36 @@ async def receive_photo(event: Union[Message, CallbackQuery], state: FSMContext)
     data = buf.getvalue()
 
     ext = Path(file.file_path).suffix.lower() if file.file_path else ".jpg"
+    # Уменьшаем до размера, который реально использует veo, и убираем EXIF
+    prepared = await config.tg_bot.image_prep.prepare(data, ext)
+    logger.info(f"Photo prepared: {prepared.bytes_before} -> {prepared.bytes_after} bytes")
+    data = prepared.data
+    ext = prepared.ext
     filename = f"{uuid.uuid4().hex}{ext}"
+    # Сами байты держим в хранилище блобов, в FSM — только ключ
+    photo_key = await config.tg_bot.blob_store.put(data)
+    # Загрузка на kie.ai начинается сразу, пока пользователь выбирает количество видео
+    speculative_uploads.start(
+        msg.chat.id, photo_key, lambda: _upload_quietly(config, data, filename)
+    )
     await state.update_data(
-        photo_bytes=data,
         photo_filename=filename,
-        photo_mime=f"image/{ext.lstrip('.')}"
+        photo_mime=f"image/{ext.lstrip('.')}",
+        photo_key=photo_key,
     )
     await msg.answer("✨ Сколько роликов создать для вас?",
                      reply_markup=await video_count_kb(data_state.get("side_orientation")))
 
 
+async def _upload_quietly(config: Config, data: bytes, filename: str) -> Optional[str]:
+    try:
+        return await config.tg_bot.veo_svc.upload_image(data, filename)
+    except Exception as e:
+        # Не страшно: при запуске генерации загрузка повторится
+        logger.warning(f"Speculative upload failed: {e}")
+        return None
+
+
 @video_router.callback_query(F.data.in_(["vid_cnt_1", "vid_cnt_2", "vid_cnt_3"]))
 async def choose_video_count(call: CallbackQuery, state: FSMContext, config: Config):
     count = int(call.data.rsplit("_", 1)[-1])
@@ -147,19 +190,44 @@ async def generate_multiple_videos(message: Message, state: FSMContext, config:
     prompt = data.get("prompt")
     model = data.get("model_type")
     aspect = data.get("side_orientation")
-    image_bytes = data.get("photo_bytes")
     image_filename = data.get("photo_filename")
+    photo_key = data.get("photo_key")
 
     if not prompt or not model or not aspect:
         await message.answer("Недостаточно данных для генерации.", reply_markup=await back_to_menu_kb())
         await state.set_state(None)
         return
 
+    # Фото, как правило, уже загружено в фоне с момента получения
+    image_url = None
+    image_bytes = None
+    if photo_key:
+        pending_upload = speculative_uploads.take(message.chat.id, photo_key)
+        if pending_upload is not None:
+            image_url = await pending_upload
+        image_url = image_url or config.tg_bot.veo_svc.upload_cache.get(photo_key)
+        if not image_url:
+            image_bytes = await config.tg_bot.blob_store.get(photo_key)
+            if image_bytes is None:
+                await message.answer("📷 Фото устарело, отправьте его ещё раз.",
+                                     reply_markup=await wait_photo_kb(aspect))
+                return
+
+    breaker = config.tg_bot.veo_svc.breaker
+    if breaker.is_open:
+        # kie.ai сейчас сбоит — не списываем монеты под заведомо неудачный запуск
+        await message.answer(
+            f"⚠️ Сервис генерации видео временно недоступен. Попробуйте через {max(1, round(breaker.retry_after()))} сек.",
+            reply_markup=await back_to_menu_kb()
+        )
+        return
+
     user: Client = await select_client(message.chat.id)
 
-    per_video_cost = main_config.MainConfig.CONT_MONEY_PER_FAST_VERSION if model == "veo3_fast" else main_config.MainConfig.CONT_MONEY_PER_NORMAL_VERSION
+    per_video_cost = video_cost(model)
     total_cost = per_video_cost * count
 
+    # Монеты спишутся при запуске каждого видео; здесь только проверяем, что их хватает на заказ
     if user.balance < total_cost:
         need = total_cost - user.balance
         kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -174,82 +242,50 @@ async def generate_multiple_videos(message: Message, state: FSMContext, config:
         await state.set_state(None)
         return
 
-    # Списание монет единым блоком
-    user.balance -= total_cost
-    user.save(update_fields=["balance"])
-    await message.answer(
-        f"Списано {total_cost} монет за {count} видео (по {per_video_cost} за каждое). Текущий баланс: {user.balance}."
-    )
-
     await state.set_state(None)
 
-    for idx in range(count):
-        progress_msg = await message.answer(f"({idx + 1}/{count}) Адаптирую промпт ...")
-        logger.info(f'Prompt before adaptation: {prompt}')
+    if image_bytes is not None:
+        # Фоновая загрузка не успела или не удалась — задачи в очереди должны ссылаться на готовый URL
         try:
-            response = await config.tg_bot.veo_svc.generate_video(
-                prompt_user=prompt,
-                model=model,
-                aspect_ratio=aspect,
-                image_bytes=image_bytes,
-                image_filename=image_filename,
-            )
+            image_url = await config.tg_bot.veo_svc.upload_image(image_bytes, image_filename)
         except Exception as e:
-            try:
-                await progress_msg.edit_text(
-                    f"({idx + 1}/{count}) Ошибка запуска задачи."
-                )
-            except Exception:
-                pass
-            # Возврат за конкретное несозданное задание
-            user.refresh_from_db()
-            user.balance += per_video_cost
-            user.save(update_fields=["balance"])
-            await message.answer(
-                f"Возврат {per_video_cost} мон (не удалось создать задачу). Баланс: {user.balance}."
-            )
-            continue
-
-        task_id = (response.get("data") or {}).get("taskId")
-        if not task_id:
-            try:
-                await progress_msg.edit_text(f"({idx + 1}/{count}) Ошибка: нет taskId.")
-            except Exception:
-                pass
-            user.refresh_from_db()
-            user.balance += per_video_cost
-            user.save(update_fields=["balance"])
-            await message.answer(
-                f"Возврат {per_video_cost} мон (нет taskId). Баланс: {user.balance}."
-            )
-            continue
+            logger.warning(f"Photo upload failed: {e}")
+            await message.answer("📷 Не удалось загрузить фото, попробуйте ещё раз.",
+                                 reply_markup=await back_to_menu_kb())
+            return
 
-        try:
-            await progress_msg.edit_text("⌛️")
-        except Exception:
-            pass
+    # Промпт адаптируем один раз на весь заказ
+    adapt_msg = await message.answer("Адаптирую промпт ...")
+    logger.info(f'Prompt before adaptation: {prompt}')
+    distinct = config.video.distinct_prompts
+    speculative = speculative_prompts.take(message.chat.id, (prompt, distinct))
+    if speculative is not None:
+        # Адаптация уже идёт (или готова) с момента ввода текста
+        prompts = (await speculative)[:count]
+    else:
+        prompts = await config.tg_bot.veo_svc.adapt_prompts(prompt, count, distinct=distinct)
+    try:
+        await adapt_msg.delete()
+    except Exception:
+        pass
 
-        try:
-            await AsyncDatabaseOperations.create_object(
-                VideoGeneration,
-                client=user,
-                task_id=task_id,
-                message_id=progress_msg.message_id,
-                coins_charged=per_video_cost
-            )
-        except Exception:
-            user.refresh_from_db()
-            user.balance += per_video_cost
-            user.save(update_fields=["balance"])
-            try:
-                await progress_msg.edit_text(
-                    f"({idx + 1}/{count}) Ошибка сохранения задачи. Возврат {per_video_cost} мон."
-                )
-            except Exception:
-                pass
-            continue
+    # Каждое видео заказа — отдельная задача в очереди со своим сообщением о статусе
+    jobs = []
+    for idx in range(count):
+        progress_msg = await message.answer(f"({idx + 1}/{count}) 🕒 Видео в очереди на запуск ...")
+        jobs.append(dict(
+            prompt=prompt,
+            adapted_prompt=prompts[idx],
+            model=model,
+            aspect_ratio=aspect,
+            image_url=image_url,
+            message_id=progress_msg.message_id,
+            request_key=request_key(message.chat.id, progress_msg.message_id),
+        ))
+    await enqueue_videos(user.id, jobs)
 
     await message.answer(
-        "Все задачи поставлены. Ожидайте результатов.",
+        f"Заказ принят: {count} видео. Монеты ({per_video_cost} за каждое) спишутся при запуске ролика.",
         reply_markup=await back_to_menu_kb()
     )
+    await dispatch_video_queue(config, message.bot)
@@ -0,0 +1,114 @@
+import json
+import math
+import os
+from typing import Iterable, Optional, Tuple
+
+from tgbot.misc.latency import RollingPercentiles
+
+# Пока замеров мало — опираемся на заявленное kie.ai время генерации (сек): fast 3–5 мин, ultra 5–7 мин
+STATIC_RANGES = {
+    "veo3_fast": (180, 300),
+    "veo3": (300, 420),
+}
+DEFAULT_RANGE = (300, 420)
+# Меньше замеров — перцентили слишком шумные
+MIN_SAMPLES = 10
+# Версия файла статистики: в файлах без неё лежат замеры по моменту опроса, они завышены
+STATS_VERSION = 2
+
+
+class GenerationEta:
+    """
+    Модель времени генерации: последние длительности «запуск → готово» по (модель, соотношение сторон)
+    и перцентили по ним. Хранится в памяти, периодически сбрасывается в JSON-файл.
+    Замеры — только по времени kie.ai: опрос идёт по этим же перцентилям, и время, когда готовность
+    заметил опрос, замкнуло бы модель саму на себя.
+    """
+
+    def __init__(self, window: int = 200):
+        self.stats = RollingPercentiles(window=window)
+        self.path: Optional[str] = None
+        self._dirty = False
+
+    @staticmethod
+    def _key(model: str, aspect_ratio: Optional[str]) -> str:
+        return f"{model}|{aspect_ratio}"
+
+    def observe(self, model: str, aspect_ratio: Optional[str], seconds: float) -> None:
+        if seconds <= 0:
+            return
+        self.stats.observe(self._key(model, aspect_ratio), seconds)
+        self._dirty = True
+
+    def quantile(self, model: str, aspect_ratio: Optional[str], q: float) -> Optional[float]:
+        """
+        Перцентиль длительности; при нехватке замеров по паре — по модели в целом, иначе None.
+        """
+        key = self._key(model, aspect_ratio)
+        if aspect_ratio and self.stats.count(key) >= MIN_SAMPLES:
+            return self.stats.percentile(key, q)
+        samples = sorted(
+            value for k in self.stats.keys() if k.startswith(f"{model}|") for value in self.stats.samples(k)
+        )
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[max(0, math.ceil(q * len(samples)) - 1)]
+
+    def expected_range(self, model: str, aspect_ratio: Optional[str] = None) -> Tuple[float, float]:
+        low = self.quantile(model, aspect_ratio, 0.5)
+        high = self.quantile(model, aspect_ratio, 0.9)
+        if low is None or high is None:
+            return STATIC_RANGES.get(model, DEFAULT_RANGE)
+        return low, high
+
+    def range_text(self, model: str, aspect_ratio: Optional[str] = None) -> str:
+        low, high = self.expected_range(model, aspect_ratio)
+        low_min = max(1, round(low / 60))
+        high_min = max(low_min, math.ceil(high / 60))
+        if low_min == high_min:
+            return f"~{low_min} мин"
+        return f"{low_min}–{high_min} мин"
+
+    def remaining_text(self, model: str, aspect_ratio: Optional[str], elapsed: float) -> str:
+        """
+        Оставшееся время для задачи, которая идёт elapsed секунд (по p90, чтобы не обещать лишнего).
+        """
+        _, high = self.expected_range(model, aspect_ratio)
+        left = high - elapsed
+        if left <= 30:
+            return "дольше обычного, скоро будет готово"
+        return f"осталось ≈ {math.ceil(left / 60)} мин"
+
+    def seed(self, durations: Iterable[Tuple[str, Optional[str], float]]) -> None:
+        for model, aspect_ratio, seconds in durations:
+            self.observe(model, aspect_ratio, seconds)
+
+    def load(self, path: str) -> None:
+        self.path = path
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get("version") != STATS_VERSION:
+            return
+        for key, values in (data.get("samples") or {}).items():
+            self.stats.extend(key, values)
+
+    def save(self) -> bool:
+        if not self.path or not self._dirty:
+            return False
+        self._dirty = False
+        data = {
+            "version": STATS_VERSION,
+            "samples": {key: self.stats.samples(key) for key in self.stats.keys()},
+        }
+        tmp_path = f"{self.path}.tmp"
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(tmp_path, self.path)
+        return True
+
+
+generation_eta = GenerationEta()
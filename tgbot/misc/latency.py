@@ -0,0 +1,50 @@
+import math
+from collections import deque
+from typing import Dict, Hashable, Iterable, Optional
+
+
+class RollingPercentiles:
+    """
+    Последние window замеров по каждому ключу и перцентили по ним.
+    Память ограничена: window чисел на ключ.
+    """
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[Hashable, deque] = {}
+
+    def observe(self, key: Hashable, value: float) -> None:
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.window)
+        samples.append(value)
+
+    def extend(self, key: Hashable, values: Iterable[float]) -> None:
+        for value in values:
+            self.observe(key, value)
+
+    def count(self, key: Hashable) -> int:
+        return len(self._samples.get(key, ()))
+
+    def percentile(self, key: Hashable, q: float) -> Optional[float]:
+        samples = self._samples.get(key)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        # Ближайший ранг: p95 по 20 замерам — 19-й по величине
+        return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+    def samples(self, key: Hashable) -> list:
+        return list(self._samples.get(key, ()))
+
+    def keys(self) -> list:
+        return list(self._samples)
+
+    def summary(self, quantiles: Iterable[float] = (0.5, 0.95)) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for key in self._samples:
+            stats = {"n": self.count(key)}
+            for q in quantiles:
+                stats[f"p{round(q * 100)}"] = round(self.percentile(key, q), 3)
+            result[str(key)] = stats
+        return result
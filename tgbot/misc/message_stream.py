@@ -0,0 +1,113 @@
+import asyncio
+import time
+from typing import List, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+from loguru import logger
+
+MAX_TG_LEN = 4096
+SAFE_SPLIT = 4000  # запас
+CURSOR = " ▌"
+
+
+def split_long(text: str):
+    if len(text) <= MAX_TG_LEN:
+        return [text]
+    parts = []
+    current = []
+    current_len = 0
+    for line in text.splitlines(keepends=True):
+        if current_len + len(line) > SAFE_SPLIT:
+            parts.append("".join(current))
+            current = [line]
+            current_len = len(line)
+        else:
+            current.append(line)
+            current_len += len(line)
+    if current:
+        parts.append("".join(current))
+    # Дополнительное дробление очень длинных без переносов
+    final = []
+    for p in parts:
+        if len(p) <= MAX_TG_LEN:
+            final.append(p)
+        else:
+            for i in range(0, len(p), SAFE_SPLIT):
+                final.append(p[i:i + SAFE_SPLIT])
+    return final
+
+
+class ThrottledMessageEditor:
+    """
+    Показ растущего текста (стриминг ответа) в Telegram: сообщение редактируется не чаще раза в interval секунд.
+    Текст режется через split_long — каждая часть живёт в своём сообщении, новые части досылаются
+    по мере роста, уже отправленные правятся, только если граница части сдвинулась.
+    Текст уходит без разметки: незакрытые теги в середине ответа ломали бы HTML-парсинг.
+    """
+
+    def __init__(self, message: Message, interval: float = 1.0):
+        # message — первое сообщение («Думаю над ответом ...»), его и редактируем
+        self.interval = interval
+        self._messages: List[Message] = [message]
+        self._shown: List[Optional[str]] = [message.text]
+        self._text = ""
+        self._next_edit_at = 0.0
+        self.edits = 0
+
+    async def update(self, text: str) -> None:
+        self._text = text
+        if time.monotonic() >= self._next_edit_at:
+            await self._render(final=False)
+
+    async def finish(self, text: Optional[str] = None) -> List[Message]:
+        """
+        Окончательный вид без курсора; правки идут без пропусков, при flood-лимите — после паузы.
+        """
+        if text is not None:
+            self._text = text
+        await self._render(final=True)
+        return self._messages
+
+    async def _render(self, final: bool) -> None:
+        chunks = [chunk for chunk in split_long(self._text) if chunk.strip()]
+        if not chunks:
+            return
+        if not final and len(chunks[-1]) + len(CURSOR) <= MAX_TG_LEN:
+            chunks[-1] += CURSOR
+        for index, chunk in enumerate(chunks):
+            if index < len(self._shown) and self._shown[index] == chunk:
+                continue
+            if not await self._show(index, chunk, final):
+                return
+        self._next_edit_at = time.monotonic() + self.interval
+
+    async def _show(self, index: int, chunk: str, final: bool) -> bool:
+        while True:
+            try:
+                if index < len(self._messages):
+                    await self._messages[index].edit_text(chunk, parse_mode=None)
+                else:
+                    self._messages.append(await self._messages[0].answer(chunk, parse_mode=None))
+                    self._shown.append(None)
+                self._shown[index] = chunk
+                self.edits += 1
+                return True
+            except TelegramRetryAfter as e:
+                if not final:
+                    # Промежуточный кадр не стоит ожидания — покажем свежий текст после паузы
+                    self._next_edit_at = time.monotonic() + e.retry_after
+                    return False
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if "message is not modified" in str(e):
+                    self._shown[index] = chunk
+                    return True
+                logger.warning(f"Stream edit failed: {e}")
+                if not final or index >= len(self._messages):
+                    self._next_edit_at = time.monotonic() + self.interval
+                    return False
+                # Сообщение удалено или не редактируется — окончательный текст отправляем заново
+                self._messages[index] = await self._messages[0].answer(chunk, parse_mode=None)
+                self._shown[index] = chunk
+                return True
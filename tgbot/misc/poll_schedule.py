@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from django.utils import timezone
+
+from tgbot.misc.eta import GenerationEta
+
+# Ожидаемое время генерации по модели (сек), пока нет собственной статистики: fast 3–5 мин, ultra 5–7 мин
+EXPECTED_GENERATION_SECONDS = {
+    "veo3_fast": 180,
+    "veo3": 300,
+}
+DEFAULT_GENERATION_SECONDS = 300
+
+# Интервалы между повторными проверками: чем дольше задача не готова, тем реже опрашиваем
+POLL_BACKOFF_SECONDS = (30, 45, 60, 90, 120, 180, 300)
+
+# Проверки статуса приурочены к перцентилям наблюдаемой длительности генерации
+POLL_QUANTILES = (0.5, 0.75, 0.9, 0.95)
+MIN_POLL_GAP_SECONDS = 15
+
+
+def first_poll_at(
+        model: str,
+        now: Optional[datetime] = None,
+        grace: int = 0,
+        aspect_ratio: Optional[str] = None,
+        eta: Optional[GenerationEta] = None,
+) -> datetime:
+    """
+    Время первой проверки статуса: раньше ожидаемой длительности генерации опрашивать бессмысленно.
+    С моделью ETA — медиана длительности для этой модели и соотношения сторон.
+    grace — запас на доставку колбэка kie.ai: при включённом вебхуке опрос лишь подстраховывает.
+    """
+    now = now or timezone.now()
+    expected = eta.quantile(model, aspect_ratio, POLL_QUANTILES[0]) if eta else None
+    if expected is None:
+        expected = EXPECTED_GENERATION_SECONDS.get(model, DEFAULT_GENERATION_SECONDS)
+    return now + timedelta(seconds=expected + grace)
+
+
+def next_poll_at(poll_attempts: int, now: Optional[datetime] = None) -> datetime:
+    """
+    Время следующей проверки после poll_attempts неудачных попыток (экспоненциальная задержка с потолком).
+    """
+    now = now or timezone.now()
+    idx = min(max(poll_attempts - 1, 0), len(POLL_BACKOFF_SECONDS) - 1)
+    return now + timedelta(seconds=POLL_BACKOFF_SECONDS[idx])
+
+
+def targeted_poll_at(
+        created: datetime,
+        model: str,
+        aspect_ratio: Optional[str],
+        poll_attempts: int,
+        now: Optional[datetime] = None,
+        grace: int = 0,
+        eta: Optional[GenerationEta] = None,
+) -> datetime:
+    """
+    Следующая проверка незавершённой задачи: ближайший ещё не пройденный перцентиль длительности,
+    а когда задача дольше p95 (или статистики нет) — обычная нарастающая задержка.
+    """
+    now = now or timezone.now()
+    if eta is not None:
+        for q in POLL_QUANTILES:
+            expected = eta.quantile(model, aspect_ratio, q)
+            if expected is None:
+                break
+            target = created + timedelta(seconds=expected + grace)
+            if target >= now + timedelta(seconds=MIN_POLL_GAP_SECONDS):
+                return target
+    return next_poll_at(poll_attempts, now)
@@ -0,0 +1,157 @@
+import hashlib
+import random
+from array import array
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from tgbot.misc.utils import normalize_text
+
+# Простое Мерсенна 2^61 - 1: (a * x + b) mod P даёт семейство независимых хэш-перестановок
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+@dataclass
+class PromptMatch:
+    prompt: str
+    adapted: str
+    similarity: float
+
+
+class PromptIndex:
+    """
+    Поиск почти одинаковых промптов: MinHash-сигнатуры по словесным k-граммам нормализованного текста
+    и LSH-корзины по полосам сигнатуры. Кандидат из корзины принимается, только если в нём те же слова
+    (замена любого слова — другой ролик) и точное сходство Жаккара по k-граммам не ниже threshold:
+    так совпадают переформулировки порядка, но не промпты с другим содержанием.
+    Память ограничена: не больше maxsize записей, самые давно не использованные вытесняются.
+    """
+
+    def __init__(
+            self,
+            maxsize: int = 2000,
+            threshold: float = 0.95,
+            num_perm: int = 64,
+            bands: int = 16,
+            shingle_size: int = 2,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rnd = random.Random(num_perm)
+        self._perms = [
+            (rnd.randrange(1, _MERSENNE_PRIME), rnd.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)
+        ]
+        # нормализованный промпт -> (сигнатура, адаптированный промпт); порядок — LRU
+        self._entries: "OrderedDict[str, Tuple[array, str]]" = OrderedDict()
+        self._buckets: Dict[Tuple[int, bytes], Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _grams(self, text: str) -> Set[str]:
+        words = text.split()
+        if len(words) <= self.shingle_size:
+            return {text}
+        return {" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def _shingles(self, text: str) -> Set[int]:
+        return {
+            int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "little")
+            for gram in self._grams(text)
+        }
+
+    def signature(self, text: str) -> array:
+        hashes = self._shingles(text)
+        return array("Q", (
+            min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self._perms
+        ))
+
+    def _band_keys(self, signature: array) -> List[Tuple[int, bytes]]:
+        return [
+            (band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)
+        ]
+
+    def match_score(self, key: str, candidate: str) -> float:
+        """
+        Точное сходство двух нормализованных промптов; 0, если отличается хоть одно слово.
+        """
+        if Counter(key.split()) != Counter(candidate.split()):
+            return 0.0
+        left, right = self._grams(key), self._grams(candidate)
+        return len(left & right) / len(left | right)
+
+    def add(self, prompt: str, adapted: str) -> None:
+        key = normalize_text(prompt)
+        if not key or not adapted:
+            return
+        if key in self._entries:
+            self._entries[key] = (self._entries[key][0], adapted)
+            self._entries.move_to_end(key)
+            return
+        signature = self.signature(key)
+        self._entries[key] = (signature, adapted)
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        signature, _ = self._entries.pop(key)
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def lookup(self, prompt: str) -> Optional[PromptMatch]:
+        """
+        Самый похожий проиндексированный промпт со сходством не ниже threshold, иначе None.
+        """
+        key = normalize_text(prompt)
+        if not key:
+            return None
+        # Снимок на случай подмены индекса пересборкой из другого потока
+        entries, buckets = self._entries, self._buckets
+        entry = entries.get(key)
+        if entry is not None:
+            entries.move_to_end(key)
+            self.hits += 1
+            return PromptMatch(prompt=key, adapted=entry[1], similarity=1.0)
+        signature = self.signature(key)
+        candidates = set()
+        for band_key in self._band_keys(signature):
+            candidates.update(buckets.get(band_key, ()))
+        best = None
+        for candidate in candidates:
+            score = self.match_score(key, candidate)
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (candidate, score)
+        if best is None:
+            self.misses += 1
+            return None
+        entries.move_to_end(best[0])
+        self.hits += 1
+        return PromptMatch(prompt=best[0], adapted=entries[best[0]][1], similarity=best[1])
+
+    def rebuild(self, pairs: Iterable[Tuple[str, str]]) -> None:
+        """
+        Пересборка с нуля из пар (промпт, адаптированный промпт); пары идут от старых к новым.
+        Новый индекс собирается отдельно и подменяет старый целиком — можно звать из потока (asyncio.to_thread),
+        поиск в event loop всё это время видит прежний индекс.
+        """
+        fresh = PromptIndex(self.maxsize, self.threshold, self.num_perm, self.bands, self.shingle_size)
+        for prompt, adapted in pairs:
+            fresh.add(prompt, adapted)
+        self._entries, self._buckets = fresh._entries, fresh._buckets
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._entries), "buckets": len(self._buckets), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,90 @@
+import os
+import time
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+PLACEHOLDER = "{insert_here}"
+DEFAULT_TEMPLATE = "default"
+
+
+class PromptTemplate:
+    """
+    Шаблон промпта из файла, заранее разрезанный по {insert_here}: подстановка — один join без чтения с диска.
+    Файл перечитывается, только когда изменился его mtime; проверка не чаще раза в check_interval секунд.
+    """
+
+    def __init__(self, path: str, check_interval: float = 5):
+        self.path = path
+        self.check_interval = check_interval
+        self._parts: Optional[List[str]] = None
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self.reloads = 0
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Перечитывает файл, если он изменился (или force). Ошибка чтения оставляет прежнюю версию.
+        """
+        self._checked_at = time.monotonic()
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if not force and self._parts is not None and mtime == self._mtime:
+                return False
+            with open(self.path, "r", encoding="utf-8") as file:
+                text = file.read()
+        except OSError as e:
+            if self._parts is None:
+                raise
+            logger.warning(f"Prompt template {self.path} reload failed, keeping the previous version: {e}")
+            return False
+        self._parts = text.split(PLACEHOLDER)
+        self._mtime = mtime
+        self.reloads += 1
+        return True
+
+    def refresh(self) -> None:
+        if self._parts is None or time.monotonic() - self._checked_at >= self.check_interval:
+            if self.reload() and self.reloads > 1:
+                logger.info(f"Prompt template {self.path} reloaded")
+
+    @property
+    def version(self) -> int:
+        # Меняется при каждой перезагрузке: адаптации по старой версии шаблона не переиспользуются
+        self.refresh()
+        return self.reloads
+
+    def render(self, value: str) -> str:
+        self.refresh()
+        return value.join(self._parts)
+
+
+class PromptTemplates:
+    """
+    Именованные шаблоны промптов; default — основной (PROMPT_FILE).
+    """
+
+    def __init__(self, paths: Dict[str, str], check_interval: float = 5):
+        self.templates = {name: PromptTemplate(path, check_interval) for name, path in paths.items()}
+
+    def get(self, name: str = DEFAULT_TEMPLATE) -> PromptTemplate:
+        template = self.templates.get(name)
+        if template is None:
+            raise KeyError(f"Unknown prompt template: {name}")
+        return template
+
+    def render(self, value: str, name: str = DEFAULT_TEMPLATE) -> str:
+        return self.get(name).render(value)
+
+    def reload_all(self) -> Dict[str, bool]:
+        """
+        Принудительная перезагрузка всех шаблонов (команда администратора): имя -> удалось ли перечитать.
+        """
+        result = {}
+        for name, template in self.templates.items():
+            try:
+                result[name] = template.reload(force=True)
+            except OSError as e:
+                logger.warning(f"Prompt template {name} reload failed: {e}")
+                result[name] = False
+        return result
@@ -0,0 +1,152 @@
+import asyncio
+import time
+from typing import Any, Dict
+
+
+class CircuitOpenError(Exception):
+    """
+    Вызов отклонён без обращения к сервису: предохранитель разомкнут.
+    """
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"{name} is unavailable, retry after {retry_after:.0f}s")
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов «ведро с токенами» в пределах процесса:
+    rate токенов в секунду, не больше capacity подряд.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waited = 0.0
+
+    def _take(self, tokens: float) -> float:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1) -> None:
+        # Под замком ждущие обслуживаются по очереди, без гонки за один токен
+        async with self._lock:
+            while True:
+                wait = self._take(tokens)
+                if not wait:
+                    return
+                self.waited += wait
+                await asyncio.sleep(wait)
+
+
+class RedisTokenBucket:
+    """
+    То же ведро в Redis: все экземпляры бота делят один бюджет запросов.
+    """
+
+    SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = (requested - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, redis, key: str, rate: float, capacity: int):
+        self.redis = redis
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+        self.waited = 0.0
+
+    async def acquire(self, tokens: float = 1) -> None:
+        while True:
+            wait = float(await self.redis.eval(self.SCRIPT, 1, self.key, self.rate, self.capacity, time.time(), tokens))
+            if not wait:
+                return
+            self.waited += wait
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после failure_threshold ошибок подряд вызовы отклоняются сразу (CircuitOpenError)
+    в течение recovery_timeout секунд, затем пропускается пробный вызов — успех замыкает цепь обратно.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._stats = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN
+
+    def retry_after(self) -> float:
+        return max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+
+    def before_call(self) -> None:
+        state = self.state
+        if state == self.OPEN or (state == self.HALF_OPEN and self._trial_running):
+            self._stats["rejected"] += 1
+            raise CircuitOpenError(self.name, self.retry_after())
+        if state == self.HALF_OPEN:
+            self._trial_running = True
+
+    def record_success(self) -> None:
+        self._state = self.CLOSED
+        self._failures = 0
+        self._trial_running = False
+
+    def release(self) -> None:
+        # Вызов прерван без результата (отмена) — пробный слот освобождается
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._trial_running or self._failures >= self.failure_threshold:
+            if self._state != self.OPEN or self._trial_running:
+                self._stats["opened"] += 1
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+        self._trial_running = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "failures": self._failures, **self._stats}
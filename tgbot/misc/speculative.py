@@ -0,0 +1,53 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class SpeculativeTasks:
+    """
+    Фоновые задачи, запущенные заранее, пока пользователь думает над следующим шагом.
+    Хранятся по ключу (обычно chat_id) вместе с меткой входных данных: результат забирается
+    только если метка совпала, а новый запуск по тому же ключу отменяет предыдущий.
+    """
+
+    def __init__(self, max_age: float = 1800):
+        self.max_age = max_age
+        self._tasks: Dict[Hashable, Tuple[Hashable, float, asyncio.Task]] = {}
+
+    def start(self, key: Hashable, tag: Hashable, factory: Callable[[], Awaitable]) -> asyncio.Task:
+        self._purge()
+        current = self._tasks.get(key)
+        if current and current[0] == tag and not current[2].cancelled():
+            return current[2]
+        self.cancel(key)
+        task = asyncio.create_task(factory())
+        self._tasks[key] = (tag, time.monotonic(), task)
+        return task
+
+    def take(self, key: Hashable, tag: Hashable) -> Optional[asyncio.Task]:
+        """
+        Забирает задачу, если она запускалась для тех же входных данных; иначе отменяет устаревшую.
+        """
+        current = self._tasks.get(key)
+        if current is None:
+            return None
+        if current[0] != tag or current[2].cancelled():
+            self.cancel(key)
+            return None
+        del self._tasks[key]
+        return current[2]
+
+    def cancel(self, key: Hashable) -> None:
+        current = self._tasks.pop(key, None)
+        if current and not current[2].done():
+            current[2].cancel()
+
+    def _purge(self) -> None:
+        # Пользователь бросил сценарий — результат больше не нужен
+        deadline = time.monotonic() - self.max_age
+        for key in [k for k, (_, started, _) in self._tasks.items() if started < deadline]:
+            self.cancel(key)
+
+
+speculative_prompts = SpeculativeTasks()
+speculative_uploads = SpeculativeTasks()
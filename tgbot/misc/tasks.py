@@ -1,52 +1,548 @@
+import asyncio
+import hashlib
+import html
+import os
+import socket
+import time
+from datetime import timedelta
+from typing import Optional, Sequence
+
+import aiohttp
+
 from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError
+from aiogram.types import FSInputFile
+from asgiref.sync import sync_to_async
 from django.db import transaction
 from django.utils import timezone
+from loguru import logger
 
 from admin_panel.telebot.models import VideoGeneration, Payment
 from tgbot.config import Config
-from tgbot.models.db_commands import AsyncDatabaseOperations
+from tgbot.misc.eta import generation_eta
+from tgbot.misc.poll_schedule import first_poll_at, next_poll_at, targeted_poll_at
+from tgbot.misc.resilience import CircuitOpenError
+from tgbot.misc.utils import DownloadTooLargeError, download_to_tempfile
+from tgbot.models.db_commands import claim_due_videos, claim_undelivered_videos, complete_video, fail_video, \
+    release_lease, save_poll_schedule, select_pending_payments, select_generation_durations, claim_queued_videos, \
+    select_queue, fail_queued_video, begin_submission, start_submitted_video, requeue_submission, \
+    select_stale_submissions, select_prompt_history
+from tgbot.services import broadcaster
 from tgbot.services.cryptobot_service import CryptoBotService
+from tgbot.services.video_generate import KieUnavailableError
 from tgbot.services.yookassa_service import YandexKassaService
+from admin_panel.config import config as main_config
 
 
-async def send_user_video(config: Config, bot: Bot):
-    videos_requests = await AsyncDatabaseOperations.get_objects_filter(VideoGeneration, status='in_progress')
-    for request in videos_requests:
+# Задачи, по которым сейчас идёт доставка: следующий цикл опроса их пропускает
+_in_delivery: set[int] = set()
+_delivery_tasks: set[asyncio.Task] = set()
+
+# Лимит Bot API на загрузку файла ботом
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024
+MAX_DELIVERY_ATTEMPTS = 5
+# Через сколько секунд после завершения недоставленное видео подберёт повторная доставка
+DELIVERY_GRACE_SECONDS = 300
+# Обновление ETA в сообщениях за один цикл опроса
+MAX_ETA_EDITS_PER_CYCLE = 30
+ETA_EDIT_CONCURRENCY = 5
+
+# Идентификатор экземпляра бота для аренды задач
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Диспетчер очереди не запускается параллельно сам с собой; вызов во время работы — просьба пройти ещё раз
+_dispatch_lock = asyncio.Lock()
+_dispatch_again = False
+# Последняя показанная пользователю позиция в очереди
+_queue_positions: dict[int, int] = {}
+
+
+def request_key(chat_id: int, message_id: int) -> str:
+    """
+    Ключ идемпотентности задачи: детерминирован по сообщению-статусу, у каждого видео заказа он свой.
+    """
+    return hashlib.sha256(f"{chat_id}:{message_id}".encode()).hexdigest()[:32]
+
+
+def video_cost(model: str) -> int:
+    if model == "veo3_fast":
+        return main_config.MainConfig.CONT_MONEY_PER_FAST_VERSION
+    return main_config.MainConfig.CONT_MONEY_PER_NORMAL_VERSION
+
+
+async def _check_video_status(config: Config, request: VideoGeneration, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        try:
+            return request, await config.tg_bot.veo_svc.get_video_status(request.task_id)
+        except Exception as e:
+            logger.warning(f"Status check failed for task {request.task_id}: {e}")
+            return request, None
+
+
+def _epoch_ms(value) -> Optional[float]:
+    try:
+        return float(value) / 1000 if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def upstream_generation_seconds(request: VideoGeneration, data: dict) -> Optional[float]:
+    """
+    Длительность генерации по времени kie.ai: completeTime (из record-info или момент прихода колбэка)
+    минус createTime задачи, а без него — момент отправки. Когда готовность заметил только опрос, времени нет:
+    такие замеры не меньше текущего перцентиля опроса и тянули бы модель ETA вверх.
+    """
+    completed = _epoch_ms(data.get("completeTime"))
+    if completed is None:
+        return None
+    started = _epoch_ms(data.get("createTime"))
+    if started is None:
+        started = (request.submitted_at or request.created).timestamp()
+    seconds = completed - started
+    return seconds if seconds > 0 else None
+
+
+async def process_video_result(bot: Bot, request: VideoGeneration, data: dict, admin_ids: Sequence[int] = ()):
+    """
+    Обработка финального статуса задачи: возврат монет при ошибке или отправка готового видео.
+    """
+    if data.get('errorCode'):
+        # Условный переход статуса: задачу завершает и возвращает монеты только один экземпляр
+        result = await fail_video(request.id, data.get('errorMessage'))
+        if result is None:
+            logger.info(f"Task {request.task_id} already finalized elsewhere")
+            return
+        refunded, balance = result
+        if refunded > 0:
+            await bot.edit_message_text(
+                chat_id=request.client.telegram_id,
+                message_id=request.message_id,
+                text=f"Ошибка генерации: {data.get('errorMessage')}.\nВозврат {refunded} мон. Баланс: {balance}"
+            )
+    elif data.get('response'):
+        result_url = data['response']['resultUrls'][0]
+        generation_seconds = upstream_generation_seconds(request, data)
+        # Запас на саму отправку: доставка из колбэка идёт без аренды, повтор не должен её обогнать
+        retry_at = timezone.now() + timedelta(seconds=DELIVERY_GRACE_SECONDS)
+        if not await complete_video(request.id, result_url, generation_seconds, retry_at):
+            logger.info(f"Task {request.task_id} already finalized elsewhere")
+            return
+        request.status = 'completed'
+        request.result_url = result_url
+        request.delivery_attempts += 1
+        if generation_seconds is not None:
+            generation_eta.observe(request.model, request.aspect_ratio, generation_seconds)
+        try:
+            await bot.delete_message(chat_id=request.client.telegram_id,
+                                     message_id=request.message_id)
+        except Exception:
+            pass
+        await deliver_video(bot, request, attempt_recorded=True, admin_ids=admin_ids)
+
+
+async def _send_video_upload(bot: Bot, chat_id: int, url: str, caption: str):
+    """
+    Скачивает видео потоково во временный файл и загружает его в Telegram как multipart.
+    """
+    path = await download_to_tempfile(url, suffix=".mp4", max_bytes=TELEGRAM_UPLOAD_LIMIT)
+    try:
+        return await bot.send_video(chat_id=chat_id, caption=caption, video=FSInputFile(path), supports_streaming=True)
+    finally:
+        os.remove(path)
+
+
+async def send_video_cached(bot: Bot, request: VideoGeneration, chat_id: int, caption: str):
+    """
+    Отправляет видео задачи: по сохранённому file_id без повторного скачивания, иначе по ссылке
+    (с загрузкой файла, если Telegram не смог скачать ссылку). После первой отправки запоминает file_id.
+    """
+    if request.tg_file_id:
+        try:
+            return await bot.send_video(chat_id=chat_id, caption=caption, video=request.tg_file_id)
+        except TelegramBadRequest as e:
+            logger.warning(f"Cached file_id rejected for task {request.task_id}: {e}")
+    try:
+        message = await bot.send_video(chat_id=chat_id, caption=caption, video=request.result_url)
+    except (TelegramBadRequest, TelegramNetworkError) as e:
+        logger.warning(f"Send by URL failed for task {request.task_id}, uploading file: {e}")
+        message = await _send_video_upload(bot, chat_id, request.result_url, caption)
+    if message and message.video:
+        request.tg_file_id = message.video.file_id
+        request.tg_file_unique_id = message.video.file_unique_id
+        await sync_to_async(request.save)(update_fields=["tg_file_id", "tg_file_unique_id"])
+    return message
+
+
+async def _give_up_delivery(bot: Bot, request: VideoGeneration, reason: str, admin_ids: Sequence[int]):
+    """
+    Видео не удаётся отправить файлом (попытки кончились или файл слишком большой):
+    повторы прекращаем, пользователю — ссылка, администраторам — отчёт.
+    """
+    request.delivery_error = reason[:1000]
+    request.next_poll_at = None
+    await sync_to_async(request.save)(update_fields=["delivery_attempts", "delivery_error", "next_poll_at"])
+    logger.error(f"Giving up delivery of video {request.id} (task {request.task_id}): {reason}")
+    try:
+        await bot.send_message(
+            chat_id=request.client.telegram_id,
+            text=f"Не удалось отправить видео в Telegram. Скачайте его по ссылке: {html.escape(request.result_url)}",
+        )
+    except Exception as e:
+        logger.warning(f"Link message for video {request.id} failed: {e}")
+    await broadcaster.broadcast(
+        bot, admin_ids,
+        f"Видео #{request.id} (клиент {request.client.telegram_id}) не доставлено, попыток "
+        f"{request.delivery_attempts}: {html.escape(reason[:300])}\n{html.escape(request.result_url)}",
+    )
+
+
+async def deliver_video(
+        bot: Bot, request: VideoGeneration, attempt_recorded: bool = False, admin_ids: Sequence[int] = ()
+) -> bool:
+    """
+    Отправка готового видео пользователю.
+    Попытки и ошибка сохраняются в записи, неудачная доставка повторяется при следующих опросах;
+    после MAX_DELIVERY_ATTEMPTS или для файла больше лимита пользователь получает ссылку, а администраторы — сообщение.
+    attempt_recorded — попытка уже учтена (первую записывает complete_video).
+    """
+    caption = f"Видео готово! Ссылка: {request.result_url}"
+    if not attempt_recorded:
+        request.delivery_attempts += 1
+    try:
+        await send_video_cached(bot, request, request.client.telegram_id, caption)
+    except DownloadTooLargeError as e:
+        # Файл больше лимита загрузки ботом — повторы не помогут, сразу отдаём ссылку
+        await _give_up_delivery(bot, request, f"file too large: {e}", admin_ids)
+        return False
+    except Exception as e:
+        if request.delivery_attempts >= MAX_DELIVERY_ATTEMPTS:
+            await _give_up_delivery(bot, request, str(e), admin_ids)
+            return False
+        request.delivery_error = str(e)[:1000]
+        request.next_poll_at = next_poll_at(request.delivery_attempts)
+        await sync_to_async(request.save)(update_fields=["delivery_attempts", "delivery_error", "next_poll_at"])
+        logger.warning(f"Delivery attempt {request.delivery_attempts} failed for task {request.task_id}: {e}")
+        return False
+    request.delivered_at = timezone.now()
+    request.delivery_error = None
+    await sync_to_async(request.save)(update_fields=["delivery_attempts", "delivery_error", "delivered_at"])
+    return True
+
+
+async def _deliver_video(bot: Bot, request: VideoGeneration, data: dict | None, admin_ids: Sequence[int]):
+    try:
+        if data is None:
+            await deliver_video(bot, request, admin_ids=admin_ids)
+        else:
+            await process_video_result(bot, request, data, admin_ids)
+    except Exception as e:
+        logger.exception(f"Delivery failed for task {request.task_id}: {e}")
+    finally:
+        _in_delivery.discard(request.id)
+        try:
+            await release_lease(request.id, WORKER_ID)
+        except Exception:
+            pass
+
+
+def schedule_delivery(
+        bot: Bot, request: VideoGeneration, data: dict | None, admin_ids: Sequence[int] = ()
+) -> bool:
+    """
+    Запускает доставку отдельной задачей, чтобы медленная отправка в Telegram не тормозила опрос статусов.
+    data=None — повторная отправка уже готового видео; admin_ids — кому сообщить, если видео не доставлено.
+    """
+    if request.id in _in_delivery:
+        return False
+    _in_delivery.add(request.id)
+    task = asyncio.create_task(_deliver_video(bot, request, data, admin_ids))
+    _delivery_tasks.add(task)
+    task.add_done_callback(_delivery_tasks.discard)
+    return True
+
+
+async def _update_eta_message(bot: Bot, request: VideoGeneration, now, semaphore: asyncio.Semaphore):
+    eta_text = generation_eta.remaining_text(
+        request.model, request.aspect_ratio, (now - (request.submitted_at or request.created)).total_seconds()
+    )
+    # Строку о списании оставляем: сообщение — единственное место, где пользователь видит цену ролика
+    charge_line = f"Списано {request.coins_charged} мон.\n" if request.coins_charged else ""
+    async with semaphore:
         try:
-            status = await config.tg_bot.veo_svc.get_video_status(request.task_id)
+            await bot.edit_message_text(
+                chat_id=request.client.telegram_id,
+                message_id=request.message_id,
+                text=f"{charge_line}⌛️ Видео генерируется, {eta_text}",
+            )
         except Exception:
+            pass
+
+
+async def expire_video(bot: Bot, request: VideoGeneration, max_age: int):
+    """
+    Задача дольше max_age без результата: завершаем с возвратом монет.
+    """
+    result = await fail_video(request.id, f"Нет результата за {max_age} с")
+    if result is None:
+        return
+    refunded, balance = result
+    logger.warning(f"Task {request.task_id} expired after {max_age}s without result, refunded {refunded}")
+    await _edit_job_message(
+        bot, request.client.telegram_id, request.message_id,
+        f"Генерация не завершилась за {max_age // 60} мин.\nВозврат {refunded} мон. Баланс: {balance}."
+    )
+
+
+async def send_user_video(config: Config, bot: Bot):
+    started = time.monotonic()
+    breaker = config.tg_bot.veo_svc.breaker
+    if breaker.is_open:
+        # kie.ai сбоит — не добиваем его опросом, задачи дождутся следующих циклов
+        logger.warning(f"kie.ai circuit is open, status polling skipped for {breaker.retry_after():.0f}s")
+        videos_requests = []
+    else:
+        videos_requests = await claim_due_videos(WORKER_ID, config.video.lease_seconds, config.video.claim_batch)
+    requests = [request for request in videos_requests if request.id not in _in_delivery]
+
+    semaphore = asyncio.Semaphore(config.video.poll_concurrency)
+    results = await asyncio.gather(*(_check_video_status(config, request, semaphore) for request in requests))
+
+    errors = 0
+    finished = 0
+    pending = []
+    eta_updates = []
+    expired = []
+    now = timezone.now()
+    for request, status in results:
+        data = (status or {}).get('data') or {}
+        if data.get('errorCode') or data.get('response'):
+            if schedule_delivery(bot, request, data, config.tg_bot.admin_ids):
+                finished += 1
+            continue
+        if (now - (request.submitted_at or request.created)).total_seconds() > config.video.max_generation_age:
+            # kie.ai так и не отдал результат (потерял задачу или не отвечает) — не держим слот вечно
+            expired.append(request)
             continue
-        if status['data']['errorCode']:
-            request.status = 'failed'
-            request.failed_message = status['data']['errorMessage']
-            # Возврат монет за это видео
-            if request.coins_charged > 0:
-                client = request.client
-                client.balance += request.coins_charged
-                client.save(update_fields=["balance"])
-                refunded = request.coins_charged
-                request.coins_charged = 0
-                request.save(update_fields=["status", "failed_message", "coins_charged"])
-                await bot.edit_message_text(
-                    chat_id=client.telegram_id,
-                    message_id=request.message_id,
-                    text=f"Ошибка генерации: {request.failed_message}.\nВозврат {refunded} мон. Баланс: {client.balance}"
+        request.poll_attempts += 1
+        if status is None:
+            errors += 1
+            request.next_poll_at = next_poll_at(request.poll_attempts, now)
+        else:
+            # Задача ещё не готова — следующая проверка к ближайшему перцентилю длительности генерации
+            request.next_poll_at = targeted_poll_at(
+                request.submitted_at or request.created, request.model, request.aspect_ratio, request.poll_attempts, now,
+                grace=config.webhook.poll_grace if config.tg_bot.veo_svc.callback_url else 0,
+                eta=generation_eta,
+            )
+            eta_updates.append(request)
+        pending.append(request)
+    if pending:
+        await save_poll_schedule(pending)
+    for request in expired:
+        await expire_video(bot, request, config.video.max_generation_age)
+    if eta_updates:
+        # Правки сообщений ограничены по числу и параллельности: не упираемся в лимиты Telegram
+        edit_semaphore = asyncio.Semaphore(ETA_EDIT_CONCURRENCY)
+        await asyncio.gather(*(
+            _update_eta_message(bot, request, now, edit_semaphore) for request in eta_updates[:MAX_ETA_EDITS_PER_CYCLE]
+        ))
+
+    # Готовые видео, которые не удалось отправить с прошлых попыток
+    retried = 0
+    undelivered = await claim_undelivered_videos(
+        WORKER_ID, config.video.lease_seconds, config.video.claim_batch, MAX_DELIVERY_ATTEMPTS
+    )
+    for request in undelivered:
+        if schedule_delivery(bot, request, None, config.tg_bot.admin_ids):
+            retried += 1
+
+    logger.info(
+        f"Video poll cycle: checked {len(requests)} tasks in {time.monotonic() - started:.2f}s, "
+        f"finished {finished}, expired {len(expired)}, errors {errors}, delivery retries {retried}, "
+        f"deliveries in flight {len(_delivery_tasks)}"
+    )
+
+
+async def _edit_job_message(bot: Bot, chat_id: int, message_id: Optional[int], text: str):
+    if not message_id:
+        return
+    try:
+        await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
+    except Exception:
+        pass
+
+
+async def _requeue_job(bot: Bot, job: VideoGeneration):
+    await requeue_submission(job.id)
+    await _edit_job_message(
+        bot, job.client.telegram_id, job.message_id,
+        "⚠️ Сервис генерации временно недоступен, видео остаётся в очереди."
+    )
+
+
+async def _dispatch_job(config: Config, bot: Bot, job: VideoGeneration, semaphore: asyncio.Semaphore) -> bool:
+    """
+    Запуск задачи из очереди. Монеты списываются вместе с переводом записи в submitting ещё до запроса к kie.ai,
+    поэтому потерянный ответ не приводит ни к возврату за идущую генерацию, ни к повторной отправке.
+    Подтвердить такую задачу может только колбэк kie.ai с ключом запроса: без вебхука (callback_url не задан)
+    неподтверждённый запуск сразу завершается с возвратом монет, как раньше.
+    """
+    chat_id = job.client.telegram_id
+    cost = video_cost(job.model)
+    async with semaphore:
+        reconcile_at = timezone.now() + timedelta(seconds=config.video.submit_reconcile)
+        submission = await begin_submission(job.id, cost, reconcile_at)
+        if submission is None:
+            logger.info(f"Video {job.id} is no longer queued, skipping")
+            return False
+        started, balance = submission
+        if not started:
+            if not await fail_queued_video(job.id, "Недостаточно монет"):
+                return False
+            await _edit_job_message(
+                bot, chat_id, job.message_id,
+                f"😔 Не хватает монет для запуска видео (нужно {cost}, на балансе {balance}), задача отменена. "
+                "Пополните баланс и закажите снова."
+            )
+            return False
+        await _edit_job_message(bot, chat_id, job.message_id, "Запускаю генерацию ...")
+        try:
+            response = await config.tg_bot.veo_svc.generate_video(
+                prompt_user=job.prompt,
+                adapted_prompt=job.adapted_prompt,
+                image_url=job.image_url,
+                model=job.model,
+                aspect_ratio=job.aspect_ratio,
+                request_key=job.request_key,
+            )
+        except (CircuitOpenError, aiohttp.ClientConnectorError):
+            # Запрос заведомо не дошёл до kie.ai — возвращаем задачу в очередь
+            await _requeue_job(bot, job)
+            return False
+        except (asyncio.TimeoutError, aiohttp.ClientError, KieUnavailableError) as e:
+            if isinstance(e, KieUnavailableError) and e.rejected:
+                # 429/503: kie.ai отклонил запрос, задача не создана
+                await _requeue_job(bot, job)
+                return False
+            if not config.tg_bot.veo_svc.callback_url:
+                # Без колбэка связать задачу с запуском нечем: ждать сверки значит вернуть монеты позже,
+                # когда видео, возможно, ещё генерируется
+                logger.warning(
+                    f"Submission of video {job.id} is unconfirmed and kie.ai webhook is disabled, refunding: {e!r}"
                 )
-            else:
-                request.save(update_fields=["status", "failed_message"])
-        elif status['data']['response']:
-            request.status = 'completed'
-            request.result_url = status['data']['response']['resultUrls'][0]
-            request.save(update_fields=["status", "result_url"])
-            await bot.delete_message(chat_id=request.client.telegram_id,
-                                     message_id=request.message_id)
-            await bot.send_video(chat_id=request.client.telegram_id,
-                                 caption=f"Видео готово! Ссылка: {request.result_url}",
-                                 video=request.result_url)
+                result = await fail_video(job.id, f"unconfirmed: {e!r}"[:1000], from_status="submitting")
+                if result:
+                    await _edit_job_message(
+                        bot, chat_id, job.message_id,
+                        f"Ошибка запуска задачи: kie.ai не ответил.\nВозврат {result[0]} мон. Баланс: {result[1]}."
+                    )
+                return False
+            # kie.ai мог принять задачу: монеты не возвращаем, ждём колбэк или сверку
+            logger.warning(f"Submission {job.request_key} of video {job.id} is unconfirmed: {e!r}")
+            await release_lease(job.id, WORKER_ID)
+            await _edit_job_message(
+                bot, chat_id, job.message_id,
+                "⏳ kie.ai не ответил вовремя, проверяем, запущена ли генерация. "
+                "Если задача не запустилась, монеты вернутся автоматически."
+            )
+            return False
+        except Exception as e:
+            logger.warning(f"Dispatch of queued video {job.id} failed: {e}")
+            result = await fail_video(job.id, str(e)[:1000], from_status="submitting")
+            if result:
+                await _edit_job_message(
+                    bot, chat_id, job.message_id,
+                    f"Ошибка запуска задачи.\nВозврат {result[0]} мон (не удалось создать задачу). Баланс: {result[1]}."
+                )
+            return False
+
+    task_id = (response.get("data") or {}).get("taskId")
+    if not task_id:
+        result = await fail_video(job.id, f"no taskId: {response}"[:1000], from_status="submitting")
+        if result:
+            await _edit_job_message(
+                bot, chat_id, job.message_id, f"Ошибка: нет taskId.\nВозврат {result[0]} мон. Баланс: {result[1]}."
+            )
+        return False
+
+    poll_at = first_poll_at(
+        job.model,
+        grace=config.webhook.poll_grace if config.tg_bot.veo_svc.callback_url else 0,
+        aspect_ratio=job.aspect_ratio,
+        eta=generation_eta,
+    )
+    if not await start_submitted_video(job.id, task_id, poll_at):
+        logger.error(f"Video {job.id} changed state while dispatching, task {task_id}")
+        return False
+    await _edit_job_message(
+        bot, chat_id, job.message_id,
+        f"Списано {cost} мон. Баланс: {balance}.\n"
+        f"⌛️ Видео генерируется, ориентировочно {generation_eta.range_text(job.model, job.aspect_ratio)}"
+    )
+    return True
+
+
+async def reconcile_submissions(config: Config, bot: Bot):
+    """
+    Сверка задач, застрявших в submitting: если к сроку kie.ai так и не прислал колбэк с ключом запроса,
+    задача считается не запущенной и монеты возвращаются. Повторно в kie.ai она не отправляется.
+    """
+    for video in await select_stale_submissions():
+        result = await fail_video(video.id, "Запуск не подтверждён kie.ai", from_status="submitting")
+        if result is None:
+            continue
+        refunded, balance = result
+        logger.warning(f"Submission {video.request_key} of video {video.id} was not confirmed, refunded {refunded}")
+        await _edit_job_message(
+            bot, video.client.telegram_id, video.message_id,
+            f"Не удалось подтвердить запуск генерации.\nВозврат {refunded} мон. Баланс: {balance}."
+        )
+
+
+async def _update_queue_positions(bot: Bot):
+    queue = await select_queue()
+    edits = []
+    for position, (video_id, chat_id, message_id) in enumerate(queue, start=1):
+        # Сообщение правим, только когда позиция сдвинулась
+        if _queue_positions.get(video_id) != position:
+            _queue_positions[video_id] = position
+            edits.append(
+                _edit_job_message(bot, chat_id, message_id, f"🕒 Видео в очереди на запуск. Позиция: {position}")
+            )
+    in_queue = {video_id for video_id, _, _ in queue}
+    for video_id in [v for v in _queue_positions if v not in in_queue]:
+        del _queue_positions[video_id]
+    await asyncio.gather(*edits)
+
+
+async def dispatch_video_queue(config: Config, bot: Bot):
+    """
+    Запуск видео из очереди в пределах лимитов одновременных задач (общего и на пользователя).
+    """
+    global _dispatch_again
+    if _dispatch_lock.locked():
+        _dispatch_again = True
+        return
+    async with _dispatch_lock:
+        while True:
+            _dispatch_again = False
+            if config.tg_bot.veo_svc.breaker.is_open:
+                return
+            jobs = await claim_queued_videos(
+                WORKER_ID, config.video.lease_seconds, config.video.max_in_flight, config.video.max_in_flight_per_user,
+                config.video.max_generation_age,
+            )
+            if jobs:
+                semaphore = asyncio.Semaphore(config.video.submit_concurrency)
+                results = await asyncio.gather(*(_dispatch_job(config, bot, job, semaphore) for job in jobs))
+                logger.info(f"Video queue: dispatched {sum(results)} of {len(jobs)} claimed")
+            await _update_queue_positions(bot)
+            if not _dispatch_again:
+                return
 
 
 async def check_pending_payments(config: Config, bot: Bot):
-    pending = await AsyncDatabaseOperations.get_objects_filter(Payment, status="pending")
+    pending = await select_pending_payments()
     yk: YandexKassaService = config.tg_bot.yookassa_svc
     cb: CryptoBotService = config.tg_bot.cryptobot_svc
 
@@ -75,7 +571,7 @@ async def check_pending_payments(config: Config, bot: Bot):
             if new_status == "paid":
                 # Атомарно: защита от двойного начисления при гонке
                 with transaction.atomic():
-                    p_refreshed = Payment.objects.select_for_update().get(id=p.id)
+                    p_refreshed = Payment.objects.select_for_update().select_related("client").get(id=p.id)
                     if p_refreshed.status != "paid":
                         p_refreshed.mark_paid(timezone.now())
                         client = p_refreshed.client
@@ -92,3 +588,48 @@ async def check_pending_payments(config: Config, bot: Bot):
 
         except Exception:
             continue
+
+
+async def log_http_pool_stats(config: Config):
+    logger.info(f"Veo HTTP pool stats: {config.tg_bot.veo_svc.pool_stats()}")
+    logger.info(f"ChatGPT HTTP pool stats: {config.tg_bot.gpt_svc.pool_stats()}")
+    logger.info(f"ChatGPT answer cache stats: {config.tg_bot.answer_cache.stats()}")
+    logger.info(f"Veo upload cache stats: {config.tg_bot.veo_svc.upload_cache.stats()}")
+    logger.info(f"Veo upload stats: {config.tg_bot.veo_svc.upload_stats}")
+    logger.info(f"Image preprocessing stats: {config.tg_bot.image_prep.stats()}")
+    logger.info(f"Prompt cache stats: {config.tg_bot.veo_svc.prompt_service.cache.stats()}")
+    if config.tg_bot.veo_svc.prompt_service.index is not None:
+        logger.info(f"Prompt index stats: {config.tg_bot.veo_svc.prompt_service.index.stats()}")
+    logger.info(f"kie.ai latency: {config.tg_bot.veo_svc.latency.summary()}, "
+                f"status hedging: {config.tg_bot.veo_svc.hedge_stats}")
+    logger.info(f"kie.ai circuit breaker: {config.tg_bot.veo_svc.breaker.stats()}, "
+                f"rate limit waits: generate {config.tg_bot.veo_svc.generate_limiter.waited:.1f}s, "
+                f"status {config.tg_bot.veo_svc.status_limiter.waited:.1f}s")
+
+
+async def load_eta_stats(config: Config):
+    generation_eta.load(config.video.eta_file)
+    if not generation_eta.stats.keys():
+        # Файла ещё нет — поднимаем статистику из истории генераций
+        generation_eta.seed(await select_generation_durations())
+    logger.info(f"Generation ETA stats: {generation_eta.stats.summary()}")
+
+
+async def load_prompt_index(config: Config):
+    index = config.tg_bot.veo_svc.prompt_service.index
+    if index is None:
+        return
+    history = await select_prompt_history(index.maxsize)
+    # MinHash на чистом Python — несколько мс на запись, event loop на это время не занимаем
+    await asyncio.to_thread(index.rebuild, history)
+    logger.info(f"Prompt index rebuilt: {index.stats()}")
+
+
+async def save_eta_stats(config: Config):
+    await asyncio.to_thread(generation_eta.save)
+
+
+async def purge_blobs(config: Config):
+    removed = await config.tg_bot.blob_store.purge_expired()
+    if removed:
+        logger.info(f"Blob store: removed {removed} expired blobs")
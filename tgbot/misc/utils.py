@@ -1,4 +1,6 @@
 import asyncio
+import re
+import tempfile
 from decimal import Decimal
 from typing import Optional
 import aiohttp
@@ -34,3 +36,56 @@ async def get_usdt_rub_rate(session: Optional[aiohttp.ClientSession] = None) ->
     finally:
         if close_session:
             await session.close()
+
+
+class DownloadTooLargeError(Exception):
+    pass
+
+
+async def download_to_tempfile(
+    url: str,
+    suffix: str = "",
+    max_bytes: Optional[int] = None,
+    session: Optional[aiohttp.ClientSession] = None,
+    chunk_size: int = 1024 * 1024,
+) -> str:
+    """
+    Потоковое скачивание файла во временный файл кусками (целиком в память не читается).
+    Возвращает путь; удалить файл — забота вызывающего.
+    """
+    close_session = False
+    if session is None:
+        session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, connect=15, sock_read=60))
+        close_session = True
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async with session.get(url) as r:
+                if r.status != 200:
+                    raise RuntimeError(f"Bad status {r.status}")
+                if max_bytes and (r.content_length or 0) > max_bytes:
+                    raise DownloadTooLargeError(f"File is {r.content_length} bytes, limit {max_bytes}")
+                written = 0
+                async for chunk in r.content.iter_chunked(chunk_size):
+                    written += len(chunk)
+                    if max_bytes and written > max_bytes:
+                        raise DownloadTooLargeError(f"File exceeds {max_bytes} bytes")
+                    await asyncio.to_thread(f.write, chunk)
+        return path
+    except BaseException:
+        os.remove(path)
+        raise
+    finally:
+        if close_session:
+            await session.close()
+
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Текст без учёта регистра, пунктуации, «ё» и лишних пробелов — для сравнения вопросов и промптов.
+    """
+    text = _PUNCTUATION.sub(" ", text.lower().replace("ё", "е"))
+    return " ".join(text.split())
@@ -1,16 +1,19 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import pytz
 from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
 
-from admin_panel.telebot.models import Client, Mailing
+from admin_panel.telebot.models import Client, Mailing, VideoGeneration, Payment
 
 
 class AsyncDatabaseOperations:
     @staticmethod
     @sync_to_async
-    def create_object(model, **kwargs):
+    def create_object(model, /, **kwargs):
         """
         Создает объект модели с заданными параметрами
         """
@@ -18,7 +21,7 @@ class AsyncDatabaseOperations:
 
     @staticmethod
     @sync_to_async
-    def get_object_or_none(model, **kwargs):
+    def get_object_or_none(model, /, **kwargs):
         """
         Возвращает объект модели, соответствующий заданным параметрам, или None, если такого объекта не существует
         """
@@ -34,7 +37,7 @@ class AsyncDatabaseOperations:
 
     @staticmethod
     @sync_to_async
-    def delete_object(model, **kwargs):
+    def delete_object(model, /, **kwargs):
         """
         Удаляет объект модели, соответствующий заданным параметрам
         """
@@ -44,7 +47,7 @@ class AsyncDatabaseOperations:
 
     @staticmethod
     @sync_to_async
-    def get_objects_filter(model, **kwargs):
+    def get_objects_filter(model, /, **kwargs):
         """
         Возвращает объекты модели, соответствующий заданным параметрам
         """
@@ -94,3 +97,319 @@ def get_all_malling():
 @sync_to_async()
 def get_all_users():
     return Client.objects.all()
+
+
+# Поля, которые нужны опросу и доставке: остальное (тексты ошибок, даты) не тянем
+POLL_VIDEO_FIELDS = (
+    "id", "task_id", "status", "model", "aspect_ratio", "created", "submitted_at", "message_id", "coins_charged",
+    "result_url",
+    "next_poll_at", "poll_attempts", "delivery_attempts", "delivered_at", "tg_file_id",
+    "client__id", "client__telegram_id",
+)
+
+
+def _claim_videos(queryset, worker_id, lease_seconds, limit):
+    """
+    Забирает задачи в аренду: SELECT ... FOR UPDATE SKIP LOCKED, чтобы несколько экземпляров бота
+    делили работу без пересечений. Аренда упавшего экземпляра истекает сама.
+    """
+    now = timezone.now()
+    free = Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now)
+    with transaction.atomic():
+        ids = list(
+            queryset.select_for_update(skip_locked=True)
+            .filter(free)
+            .order_by("next_poll_at")
+            .values_list("id", flat=True)[:limit]
+        )
+        # Условие повторяем в UPDATE: на БД без блокировок строк аренду получит только один
+        VideoGeneration.objects.filter(free, id__in=ids).update(
+            lease_owner=worker_id, lease_expires_at=now + timedelta(seconds=lease_seconds)
+        )
+    return list(
+        VideoGeneration.objects.filter(id__in=ids, lease_owner=worker_id)
+        .select_related("client")
+        .only(*POLL_VIDEO_FIELDS)
+        .order_by()
+    )
+
+
+@sync_to_async()
+def claim_due_videos(worker_id, lease_seconds, limit):
+    """
+    Задачи генерации, которым пора проверить статус
+    """
+    now = timezone.now()
+    queryset = VideoGeneration.objects.filter(status="in_progress").filter(
+        Q(next_poll_at__lte=now) | Q(next_poll_at__isnull=True)
+    )
+    return _claim_videos(queryset, worker_id, lease_seconds, limit)
+
+
+@sync_to_async()
+def claim_undelivered_videos(worker_id, lease_seconds, limit, max_attempts):
+    """
+    Готовые видео, которые не удалось отправить пользователю и пора попробовать снова
+    """
+    queryset = VideoGeneration.objects.filter(
+        status="completed",
+        delivered_at__isnull=True,
+        delivery_attempts__gt=0,
+        delivery_attempts__lt=max_attempts,
+        next_poll_at__lte=timezone.now(),
+    )
+    return _claim_videos(queryset, worker_id, lease_seconds, limit)
+
+
+@sync_to_async()
+def release_lease(video_id, worker_id):
+    VideoGeneration.objects.filter(pk=video_id, lease_owner=worker_id).update(lease_owner=None, lease_expires_at=None)
+
+
+@sync_to_async()
+def save_poll_schedule(videos):
+    """
+    Сохраняет счётчик попыток и время следующей проверки одним запросом, снимая аренду
+    """
+    for video in videos:
+        video.lease_owner = None
+        video.lease_expires_at = None
+    VideoGeneration.objects.bulk_update(videos, ["poll_attempts", "next_poll_at", "lease_owner", "lease_expires_at"])
+
+
+@sync_to_async()
+def complete_video(video_id, result_url, generation_seconds=None, retry_delivery_at=None):
+    """
+    Переводит задачу in_progress -> completed. False, если её уже обработал другой экземпляр.
+    Тем же запросом записывается первая попытка доставки: если процесс упадёт до отправки,
+    видео подберёт повторная доставка после retry_delivery_at
+    """
+    return bool(
+        VideoGeneration.objects.filter(pk=video_id, status="in_progress").update(
+            status="completed", result_url=result_url, completed_at=timezone.now(),
+            generation_seconds=generation_seconds,
+            delivery_attempts=F("delivery_attempts") + 1, next_poll_at=retry_delivery_at or timezone.now(),
+        )
+    )
+
+
+@sync_to_async()
+def select_generation_durations(limit=2000):
+    """
+    Длительности последних успешных генераций: (модель, соотношение сторон, секунды).
+    Только замеры по времени kie.ai: момент, когда готовность заметил опрос, смещён к перцентилям опроса
+    """
+    return list(
+        VideoGeneration.objects.filter(status="completed", generation_seconds__isnull=False)
+        .order_by("-completed_at")
+        .values_list("model", "aspect_ratio", "generation_seconds")[:limit]
+    )
+
+
+@sync_to_async()
+def select_prompt_history(limit=2000):
+    """
+    Пары (промпт пользователя, адаптированный промпт) последних успешных генераций, от старых к новым
+    """
+    rows = (
+        VideoGeneration.objects.filter(status="completed", prompt__isnull=False, adapted_prompt__isnull=False)
+        .order_by("-id")
+        .values_list("prompt", "adapted_prompt")[:limit]
+    )
+    return list(reversed(rows))
+
+
+@sync_to_async()
+def fail_video(video_id, failed_message, from_status="in_progress"):
+    """
+    Атомарно переводит задачу from_status -> failed и возвращает списанные монеты.
+    Возвращает (возвращено монет, новый баланс) или None, если задачу уже обработал другой экземпляр
+    """
+    with transaction.atomic():
+        video = VideoGeneration.objects.select_for_update().filter(pk=video_id, status=from_status).first()
+        if video is None:
+            return None
+        refunded = video.coins_charged
+        video.status = "failed"
+        video.failed_message = failed_message
+        video.coins_charged = 0
+        video.lease_owner = None
+        video.lease_expires_at = None
+        video.save(update_fields=["status", "failed_message", "coins_charged", "lease_owner", "lease_expires_at"])
+        Client.objects.filter(pk=video.client_id).update(balance=F("balance") + refunded)
+        return refunded, Client.objects.values_list("balance", flat=True).get(pk=video.client_id)
+
+
+# Ключ advisory-блокировки Postgres: лимиты очереди считает только один диспетчер за раз
+DISPATCH_LOCK_ID = 720_001
+QUEUE_SCAN_LIMIT = 500
+
+
+@sync_to_async()
+def enqueue_videos(client_id, jobs):
+    """
+    Ставит видео заказа в очередь (FIFO по времени создания). Монеты не списываются
+    """
+    return VideoGeneration.objects.bulk_create(
+        [VideoGeneration(client_id=client_id, status="queued", **job) for job in jobs]
+    )
+
+
+@sync_to_async()
+def claim_queued_videos(worker_id, lease_seconds, global_cap, per_user_cap, max_age):
+    """
+    Забирает из очереди столько задач, сколько позволяют общий лимит и лимит на пользователя.
+    Пользователи, упёршиеся в свой лимит, пропускаются — остальная очередь идёт по порядку.
+    Задачи, запущенные больше max_age секунд назад, места не занимают: их завершит опрос (см. expire_video)
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=max_age)
+    free = Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now)
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [DISPATCH_LOCK_ID])
+        fresh = Q(submitted_at__gte=cutoff) | Q(submitted_at__isnull=True, created__gte=cutoff)
+        busy = VideoGeneration.objects.filter(
+            Q(status="submitting")
+            | Q(fresh, status="in_progress")
+            | Q(status="queued", lease_expires_at__gte=now)
+        )
+        per_client = dict(
+            busy.order_by().values("client_id").annotate(n=Count("id")).values_list("client_id", "n")
+        )
+        slots = global_cap - sum(per_client.values())
+        if slots <= 0:
+            return []
+        picked = []
+        queued = (
+            VideoGeneration.objects.filter(free, status="queued")
+            .order_by("created", "id")
+            .values_list("id", "client_id")[:QUEUE_SCAN_LIMIT]
+        )
+        for video_id, client_id in queued:
+            if per_client.get(client_id, 0) >= per_user_cap:
+                continue
+            per_client[client_id] = per_client.get(client_id, 0) + 1
+            picked.append(video_id)
+            if len(picked) >= slots:
+                break
+        VideoGeneration.objects.filter(free, id__in=picked).update(
+            lease_owner=worker_id, lease_expires_at=now + timedelta(seconds=lease_seconds)
+        )
+    return list(
+        VideoGeneration.objects.filter(id__in=picked, lease_owner=worker_id)
+        .select_related("client")
+        .order_by("created", "id")
+    )
+
+
+@sync_to_async()
+def select_queue(limit=100):
+    """
+    Начало очереди по порядку: (id, telegram_id, message_id)
+    """
+    return list(
+        VideoGeneration.objects.filter(status="queued")
+        .order_by("created", "id")
+        .values_list("id", "client__telegram_id", "message_id")[:limit]
+    )
+
+
+@sync_to_async()
+def begin_submission(video_id, cost, reconcile_at):
+    """
+    queued -> submitting вместе со списанием монет, до обращения к kie.ai.
+    Возвращает (запущена ли отправка, баланс): (False, баланс) — монет не хватает, задача остаётся в queued;
+    None — задача уже не в очереди (её забрал другой экземпляр)
+    """
+    with transaction.atomic():
+        updated = VideoGeneration.objects.filter(pk=video_id, status="queued").update(
+            status="submitting", coins_charged=cost, submitted_at=timezone.now(), next_poll_at=reconcile_at
+        )
+        if not updated:
+            return None
+        client_id = VideoGeneration.objects.values_list("client_id", flat=True).get(pk=video_id)
+        charged = Client.objects.filter(pk=client_id, balance__gte=cost).update(balance=F("balance") - cost)
+        balance = Client.objects.values_list("balance", flat=True).get(pk=client_id)
+        if not charged:
+            transaction.set_rollback(True)
+        return bool(charged), balance
+
+
+@sync_to_async()
+def start_submitted_video(video_id, task_id, next_poll_at):
+    """
+    submitting -> in_progress, когда kie.ai вернул taskId
+    """
+    return bool(
+        VideoGeneration.objects.filter(pk=video_id, status="submitting").update(
+            status="in_progress", task_id=task_id, next_poll_at=next_poll_at, lease_owner=None, lease_expires_at=None
+        )
+    )
+
+
+@sync_to_async()
+def requeue_submission(video_id):
+    """
+    submitting -> queued с возвратом монет: запрос в kie.ai заведомо не уходил
+    """
+    with transaction.atomic():
+        video = VideoGeneration.objects.select_for_update().filter(pk=video_id, status="submitting").first()
+        if video is None:
+            return None
+        refunded = video.coins_charged
+        VideoGeneration.objects.filter(pk=video_id).update(
+            status="queued", coins_charged=0, submitted_at=None, next_poll_at=None,
+            lease_owner=None, lease_expires_at=None,
+        )
+        Client.objects.filter(pk=video.client_id).update(balance=F("balance") + refunded)
+        return Client.objects.values_list("balance", flat=True).get(pk=video.client_id)
+
+
+@sync_to_async()
+def bind_submitted_task(request_key, task_id):
+    """
+    Привязывает задачу kie.ai к записи, застрявшей в submitting (ответ на запуск потерялся),
+    по ключу запроса из callBackUrl. Возвращает запись уже в статусе in_progress или None.
+    Проверка статуса назначается сразу: если обработка колбэка сорвётся, задачу подберёт обычный опрос
+    """
+    updated = VideoGeneration.objects.filter(request_key=request_key, status="submitting").update(
+        status="in_progress", task_id=task_id, lease_owner=None, lease_expires_at=None, next_poll_at=timezone.now()
+    )
+    if not updated:
+        return None
+    return VideoGeneration.objects.select_related("client").get(request_key=request_key)
+
+
+@sync_to_async()
+def select_stale_submissions():
+    """
+    Записи в submitting, запуск которых так и не подтвердился к сроку сверки
+    """
+    return list(
+        VideoGeneration.objects.filter(status="submitting", next_poll_at__lte=timezone.now())
+        .select_related("client")
+        .order_by()
+    )
+
+
+@sync_to_async()
+def fail_queued_video(video_id, failed_message):
+    return bool(
+        VideoGeneration.objects.filter(pk=video_id, status="queued").update(
+            status="failed", failed_message=failed_message, lease_owner=None, lease_expires_at=None
+        )
+    )
+
+
+@sync_to_async()
+def select_pending_payments():
+    """
+    Ожидающие оплаты платежи для фоновой проверки — без сортировки и лишних колонок
+    """
+    return list(
+        Payment.objects.filter(status="pending")
+        .only("id", "client_id", "method", "status", "external_id")
+        .order_by()
+    )
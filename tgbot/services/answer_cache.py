@@ -0,0 +1,79 @@
+import hashlib
+from typing import Any, Dict, Optional
+
+from loguru import logger
+
+from tgbot.misc.cache import TTLCache
+from tgbot.misc.utils import normalize_text
+
+
+class AnswerCache:
+    """
+    Кэш ответов бесплатного ChatGPT: нормализованный вопрос -> ответ.
+    Первый уровень — TTLCache в процессе, второй (необязательный) — Redis, общий для всех экземпляров бота.
+    Ошибки Redis не мешают чату: запрос просто уходит в OpenAI.
+    """
+
+    def __init__(
+            self,
+            maxsize: int = 2048,
+            ttl: int = 24 * 3600,
+            redis=None,
+            prefix: str = "gpt_answer:",
+            max_question_len: int = 300,
+    ):
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.redis = redis
+        self.prefix = prefix
+        # Длинные вопросы почти не повторяются, их ответы только вытесняли бы полезные записи
+        self.max_question_len = max_question_len
+        self.hits = 0
+        self.misses = 0
+        self.redis_hits = 0
+
+    def _key(self, question: str) -> Optional[str]:
+        normalized = normalize_text(question)
+        if not normalized or len(normalized) > self.max_question_len:
+            return None
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    async def get(self, question: str) -> Optional[str]:
+        key = self._key(question)
+        if key is None:
+            return None
+        answer = self.local.get(key)
+        if answer is None and self.redis is not None:
+            try:
+                raw = await self.redis.get(f"{self.prefix}{key}")
+            except Exception as e:
+                logger.warning(f"Answer cache redis get failed: {e}")
+                raw = None
+            if raw is not None:
+                answer = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+                self.local.set(key, answer)
+                self.redis_hits += 1
+        if answer is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return answer
+
+    async def set(self, question: str, answer: str) -> None:
+        key = self._key(question)
+        if key is None or not answer.strip():
+            return
+        self.local.set(key, answer)
+        if self.redis is not None:
+            try:
+                await self.redis.set(f"{self.prefix}{key}", answer.encode("utf-8"), ex=self.ttl)
+            except Exception as e:
+                logger.warning(f"Answer cache redis set failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "redis_hits": self.redis_hits,
+            "local_size": len(self.local),
+        }
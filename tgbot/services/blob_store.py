@@ -0,0 +1,89 @@
+import asyncio
+import hashlib
+import os
+import time
+from typing import Optional
+
+
+def blob_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class LocalBlobStore:
+    """
+    Хранилище бинарных данных (фото пользователя) на локальном диске с временем жизни.
+    В FSM кладём только ключ — sha256 содержимого. Одинаковое фото от разных заказов — один блоб,
+    поэтому блобы не удаляются по заказу: их убирает только истечение TTL (повторный put его продлевает).
+    """
+
+    def __init__(self, directory: str, ttl: int = 3600):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    async def put(self, data: bytes) -> str:
+        key = blob_key(data)
+
+        def _do():
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        await asyncio.to_thread(_do)
+        return key
+
+    async def get(self, key: str) -> Optional[bytes]:
+        def _do():
+            path = self._path(key)
+            try:
+                if os.path.getmtime(path) < time.time() - self.ttl:
+                    os.remove(path)
+                    return None
+                with open(path, "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                return None
+
+        return await asyncio.to_thread(_do)
+
+    async def purge_expired(self) -> int:
+        def _do():
+            deadline = time.time() - self.ttl
+            removed = 0
+            for entry in os.scandir(self.directory):
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < deadline:
+                        os.remove(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+            return removed
+
+        return await asyncio.to_thread(_do)
+
+
+class RedisBlobStore:
+    """
+    То же хранилище поверх Redis: истечение записей делает сам Redis (SET ... EX).
+    """
+
+    def __init__(self, redis, ttl: int = 3600, prefix: str = "blob:"):
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def put(self, data: bytes) -> str:
+        key = blob_key(data)
+        await self.redis.set(f"{self.prefix}{key}", data, ex=self.ttl)
+        return key
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.redis.get(f"{self.prefix}{key}")
+
+    async def purge_expired(self) -> int:
+        return 0
@@ -1,8 +1,12 @@
+import json
+
 import aiohttp
 import os
-from typing import List, Dict, Optional, Any, Union
+from typing import List, Dict, Optional, Any, Union, AsyncIterator
 from io import BytesIO
 
+from tgbot.services.http_pool import PooledHTTPClient
+
 
 class ChatGPTService:
     CHAT_URL = "https://api.openai.com/v1/chat/completions"
@@ -13,46 +17,103 @@ class ChatGPTService:
             api_key: str,
             chat_model: str = "gpt-4o-mini",
             whisper_model: str = "whisper-1",
-            timeout: int = 120
+            timeout: int = 120,
+            pool_limit: int = 50,
+            pool_limit_per_host: int = 20,
+            stream_idle_timeout: int = 30
     ):
         self.api_key = api_key
         self.chat_model = chat_model
         self.whisper_model = whisper_model
-        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._timeout = aiohttp.ClientTimeout(total=timeout, connect=10)
+        # При стриминге total ограничивает весь ответ, sock_read — паузу между чанками
+        self._stream_timeout = aiohttp.ClientTimeout(total=timeout, connect=10, sock_read=stream_idle_timeout)
+        self.http = PooledHTTPClient(limit=pool_limit, limit_per_host=pool_limit_per_host, timeout=self._timeout)
+
+    async def start(self) -> None:
+        await self.http.start()
+
+    async def close(self) -> None:
+        await self.http.close()
+
+    def pool_stats(self) -> Dict[str, Any]:
+        return self.http.stats()
 
     def _headers(self) -> Dict[str, str]:
         return {
             "Authorization": f"Bearer {self.api_key}"
         }
 
-    async def ask(
+    def _chat_payload(
             self,
-            messages: Optional[List[Dict[str, str]]] = None,
-            question: Optional[str] = None,
-            temperature: float = 0.7,
-            top_p: float = 1.0
-    ) -> str:
+            messages: Optional[List[Dict[str, str]]],
+            question: Optional[str],
+            temperature: float,
+            top_p: float
+    ) -> Dict[str, Any]:
         if messages is None:
             messages = []
         if question:
             messages = messages + [{"role": "user", "content": question}]
-        payload = {
+        return {
             "model": self.chat_model,
             "messages": messages,
             "temperature": temperature,
             "top_p": top_p
         }
+
+    async def ask(
+            self,
+            messages: Optional[List[Dict[str, str]]] = None,
+            question: Optional[str] = None,
+            temperature: float = 0.7,
+            top_p: float = 1.0
+    ) -> str:
+        payload = self._chat_payload(messages, question, temperature, top_p)
         try:
-            async with aiohttp.ClientSession(timeout=self._timeout) as session:
-                async with session.post(self.CHAT_URL, json=payload,
-                                        headers={**self._headers(), "Content-Type": "application/json"}) as resp:
-                    if resp.status != 200:
-                        raise RuntimeError(f"Chat completion error {resp.status}: {await resp.text()}")
-                    data = await resp.json()
-                    return data["choices"][0]["message"]["content"]
+            session = await self.http.session()
+            async with session.post(self.CHAT_URL, json=payload,
+                                    headers={**self._headers(), "Content-Type": "application/json"}) as resp:
+                if resp.status != 200:
+                    raise RuntimeError(f"Chat completion error {resp.status}: {await resp.text()}")
+                data = await resp.json()
+                return data["choices"][0]["message"]["content"]
         except Exception as e:
             raise RuntimeError(f"ask failed: {e}") from e
 
+    async def ask_stream(
+            self,
+            messages: Optional[List[Dict[str, str]]] = None,
+            question: Optional[str] = None,
+            temperature: float = 0.7,
+            top_p: float = 1.0
+    ) -> AsyncIterator[str]:
+        """
+        То же, что ask, но ответ приходит по частям (SSE, stream=true): отдаёт фрагменты текста по мере генерации.
+        """
+        payload = {**self._chat_payload(messages, question, temperature, top_p), "stream": True}
+        try:
+            session = await self.http.session()
+            async with session.post(self.CHAT_URL, json=payload, timeout=self._stream_timeout,
+                                    headers={**self._headers(), "Content-Type": "application/json"}) as resp:
+                if resp.status != 200:
+                    raise RuntimeError(f"Chat completion error {resp.status}: {await resp.text()}")
+                # Событие SSE — строка "data: {...}", поток завершается "data: [DONE]"
+                async for raw_line in resp.content:
+                    line = raw_line.decode("utf-8").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        return
+                    chunk = json.loads(data)
+                    for choice in chunk.get("choices") or ():
+                        content = (choice.get("delta") or {}).get("content")
+                        if content:
+                            yield content
+        except Exception as e:
+            raise RuntimeError(f"ask_stream failed: {e}") from e
+
     async def transcribe(
             self,
             audio_path: str,
@@ -111,11 +172,11 @@ class ChatGPTService:
 
     async def _send_transcribe_form(self, form: aiohttp.FormData) -> str:
         try:
-            async with aiohttp.ClientSession(timeout=self._timeout) as session:
-                async with session.post(self.TRANSCRIBE_URL, data=form, headers=self._headers()) as resp:
-                    if resp.status != 200:
-                        raise RuntimeError(f"Transcription error {resp.status}: {await resp.text()}")
-                    data: Any = await resp.json()
-                    return data.get("text", "")
+            session = await self.http.session()
+            async with session.post(self.TRANSCRIBE_URL, data=form, headers=self._headers()) as resp:
+                if resp.status != 200:
+                    raise RuntimeError(f"Transcription error {resp.status}: {await resp.text()}")
+                data: Any = await resp.json()
+                return data.get("text", "")
         except Exception as e:
             raise RuntimeError(f"transcribe failed: {e}") from e
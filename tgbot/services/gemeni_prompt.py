@@ -1,21 +1,73 @@
 import aiohttp
 import asyncio
 
+from loguru import logger
+
+from tgbot.misc.cache import TTLCache
+from tgbot.misc.prompt_index import PromptIndex
+from tgbot.misc.prompt_template import DEFAULT_TEMPLATE, PromptTemplates
+
+VARIANT_SEPARATOR = "=====VARIANT====="
+VARIANTS_INSTRUCTION = (
+    "\n\nСоставь {count} разных вариантов итогового промпта по этой идее: "
+    "варьируй ракурсы, движение камеры и детали сцены, сохраняя замысел. "
+    "Каждый вариант — не более 3090 символов. "
+    f"Раздели варианты отдельной строкой {VARIANT_SEPARATOR} и не добавляй ничего, кроме самих промптов."
+)
+
 
 class GeminiPromptService:
-    def __init__(self, prompt_file: str, api_key: str):
+    def __init__(
+            self,
+            prompt_file: str,
+            api_key: str,
+            cache_size: int = 512,
+            cache_ttl: int = 6 * 3600,
+            index: PromptIndex | None = None,
+            templates: dict[str, str] | None = None,
+            template_check_interval: float = 5,
+    ):
         self.prompt_file = prompt_file
+        # Шаблоны держим в памяти уже разрезанными; файл перечитывается только при изменении
+        self.templates = PromptTemplates(
+            {**(templates or {}), DEFAULT_TEMPLATE: prompt_file}, check_interval=template_check_interval
+        )
         self.api_key = api_key
         self.url = "https://openrouter.ai/api/v1/chat/completions"
         self.model = "google/gemini-2.5-pro"
+        # Кэш адаптированных промптов: одинаковый текст не гоняем через LLM повторно
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        # Почти одинаковые промпты (те же слова, другая пунктуация или регистр) берут уже готовую адаптацию
+        self.index = index
+        self._index_version = None
+        # Запросы в процессе: [задача, число ожидающих]
+        self._inflight: dict = {}
+
+    @staticmethod
+    def _normalize(prompt_user: str) -> str:
+        return " ".join(prompt_user.split())
+
+    def _get_prompt(self, prompt_user: str, template: str = DEFAULT_TEMPLATE) -> str:
+        return self.templates.render(prompt_user, template)
+
+    def _cache_key(self, prompt_user: str, count: int, template: str) -> tuple:
+        return self._normalize(prompt_user), count, template, self.templates.get(template).version
+
+    def _similar_index(self, key: tuple) -> PromptIndex | None:
+        """
+        Индекс похожих промптов относится к основному шаблону; после его правки старые адаптации сбрасываются.
+        """
+        if self.index is None or key[2] != DEFAULT_TEMPLATE:
+            return None
+        if self._index_version is not None and self._index_version != key[3]:
+            self.index.rebuild(())
+        self._index_version = key[3]
+        return self.index
 
-    def _get_prompt(self, prompt_user: str) -> str:
-        with open(self.prompt_file, 'r', encoding='utf-8') as file:
-            prompt = file.read()
-        return prompt.replace('{insert_here}', prompt_user)
+    def reload_templates(self) -> dict[str, bool]:
+        return self.templates.reload_all()
 
-    async def generate(self, prompt_user: str) -> str | None:
-        result_prompt = self._get_prompt(prompt_user)
+    async def _complete(self, content: str) -> str | None:
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
@@ -25,7 +77,7 @@ class GeminiPromptService:
             "messages": [
                 {
                     "role": "user",
-                    "content": result_prompt
+                    "content": content
                 }
             ]
         }
@@ -39,3 +91,72 @@ class GeminiPromptService:
         except Exception as e:
             print(f"Ошибка генерации промпта: {e}")
             return None
+
+    async def _shared(self, key, factory):
+        """
+        Объединяет одинаковые запросы в один: второй вызов ждёт уже идущий запрос к LLM.
+        Запрос отменяется, только когда его перестали ждать все вызывающие.
+        """
+        entry = self._inflight.get(key)
+        if entry is None:
+            entry = [asyncio.create_task(factory()), 0]
+            self._inflight[key] = entry
+            entry[0].add_done_callback(
+                lambda _: self._inflight.pop(key, None) if self._inflight.get(key) is entry else None
+            )
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[0])
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                entry[0].cancel()
+
+    async def generate(self, prompt_user: str, template: str = DEFAULT_TEMPLATE) -> str | None:
+        key = self._cache_key(prompt_user, 1, template)
+        cached = self.cache.get(key)
+        if cached:
+            return cached[0]
+        index = self._similar_index(key)
+        if index is not None:
+            match = index.lookup(prompt_user)
+            if match is not None:
+                logger.info(f"Reusing adapted prompt of a similar prompt ({match.similarity:.2f}): {match.prompt}")
+                self.cache.set(key, [match.adapted])
+                return match.adapted
+        return await self._shared(key, lambda: self._generate(key, prompt_user))
+
+    async def _generate(self, key, prompt_user: str) -> str | None:
+        result = await self._complete(self._get_prompt(prompt_user, key[2]))
+        if result:
+            self.cache.set(key, [result])
+            index = self._similar_index(key)
+            if index is not None:
+                index.add(prompt_user, result)
+        return result
+
+    async def generate_variants(
+            self, prompt_user: str, count: int, template: str = DEFAULT_TEMPLATE
+    ) -> list[str | None]:
+        """
+        Несколько различающихся адаптаций одним запросом к LLM (для заказов из нескольких видео).
+        """
+        if count <= 1:
+            return [await self.generate(prompt_user, template)]
+        key = self._cache_key(prompt_user, count, template)
+        cached = self.cache.get(key)
+        if cached:
+            return list(cached)
+        return list(await self._shared(key, lambda: self._generate_variants(key, prompt_user, count)))
+
+    async def _generate_variants(self, key, prompt_user: str, count: int) -> list[str | None]:
+        result = await self._complete(
+            self._get_prompt(prompt_user, key[2]) + VARIANTS_INSTRUCTION.format(count=count)
+        )
+        if not result:
+            return [None] * count
+        variants = [v.strip() for v in result.split(VARIANT_SEPARATOR) if v.strip()][:count] or [result.strip()]
+        # Модель могла вернуть меньше вариантов — добиваем повтором имеющихся
+        variants = [variants[i % len(variants)] for i in range(count)]
+        self.cache.set(key, variants)
+        return variants
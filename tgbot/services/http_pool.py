@@ -0,0 +1,93 @@
+from typing import Optional, Dict, Any
+
+import aiohttp
+
+
+class PooledHTTPClient:
+    """
+    Долгоживущая aiohttp-сессия с keep-alive пулом соединений.
+    Открывается один раз на старте бота и закрывается при остановке,
+    чтобы не платить TCP+TLS handshake на каждый запрос.
+    """
+
+    def __init__(
+            self,
+            limit: int = 100,
+            limit_per_host: int = 20,
+            dns_ttl: int = 300,
+            keepalive_timeout: float = 60,
+            timeout: Optional[aiohttp.ClientTimeout] = None
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout or aiohttp.ClientTimeout(total=60, connect=10, sock_read=30)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self._created = 0
+        self._reused = 0
+        self._requests = 0
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self._requests += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            self._created += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self._reused += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace
+
+    async def start(self) -> None:
+        if self._session and not self._session.closed:
+            return
+        self._connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_ttl,
+            use_dns_cache=True,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=self._connector,
+            timeout=self.timeout,
+            trace_configs=[self._trace_config()],
+        )
+
+    async def close(self) -> None:
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._connector = None
+
+    async def session(self) -> aiohttp.ClientSession:
+        # Ленивое открытие на случай вызова до on_startup (скрипты, тесты)
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Состояние пула: открытые/простаивающие соединения и сколько раз соединение переиспользовано.
+        """
+        idle = 0
+        in_use = 0
+        if self._connector is not None and not self._connector.closed:
+            idle = sum(len(conns) for conns in getattr(self._connector, "_conns", {}).values())
+            in_use = len(getattr(self._connector, "_acquired", ()))
+        return {
+            "open": idle + in_use,
+            "idle": idle,
+            "in_use": in_use,
+            "created": self._created,
+            "reused": self._reused,
+            "requests": self._requests,
+        }
@@ -0,0 +1,90 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Dict
+
+from PIL import Image, ImageOps
+
+# Длинная сторона кадра veo (1080p) — одна для 16:9 и 9:16, детали сверх неё в ролик не попадают
+LONGEST_EDGE = 1920
+
+FORMAT_EXT = {
+    "JPEG": ".jpg",
+    "WEBP": ".webp",
+}
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    ext: str
+    bytes_before: int
+    bytes_after: int
+    kept_original: bool = False
+
+
+class ImagePreprocessor:
+    """
+    Нормализация фото перед загрузкой: поворот по EXIF, удаление метаданных, уменьшение
+    до нужного veo размера и перекодирование. Pillow работает в пуле потоков, event loop не блокируется.
+    Фото из Telegram уже JPEG до ~1280 px без метаданных: если уменьшать нечего, а перекодированный файл
+    не меньше исходного, отправляем исходные байты — повторное сжатие только раздувало бы загрузку.
+    """
+
+    def __init__(self, image_format: str = "JPEG", quality: int = 85, max_workers: int = 2):
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-prepare")
+        self._stats = {"images": 0, "bytes_before": 0, "bytes_after": 0, "kept_original": 0, "errors": 0}
+
+    def _prepare_sync(self, data: bytes) -> PreparedImage:
+        with Image.open(BytesIO(data)) as src:
+            # Исходник можно оставить как есть, только если он уже в нужном формате и без EXIF
+            reusable = src.format == self.image_format and not src.getexif() and "exif" not in src.info
+            # Сначала применяем ориентацию из EXIF, сами метаданные при сохранении не переносятся
+            img = ImageOps.exif_transpose(src)
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            size = img.size
+            img.thumbnail((LONGEST_EDGE, LONGEST_EDGE), Image.Resampling.LANCZOS)
+            reusable = reusable and img.size == size
+            out = BytesIO()
+            img.save(out, format=self.image_format, quality=self.quality, optimize=True)
+        result = out.getvalue()
+        if reusable and len(result) >= len(data):
+            return PreparedImage(
+                data=data,
+                ext=FORMAT_EXT.get(self.image_format, ".jpg"),
+                bytes_before=len(data),
+                bytes_after=len(data),
+                kept_original=True,
+            )
+        return PreparedImage(
+            data=result,
+            ext=FORMAT_EXT.get(self.image_format, ".jpg"),
+            bytes_before=len(data),
+            bytes_after=len(result),
+        )
+
+    async def prepare(self, data: bytes, ext: str = ".jpg") -> PreparedImage:
+        """
+        Возвращает нормализованное изображение; если Pillow не справился — исходные байты как есть.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            prepared = await loop.run_in_executor(self._executor, self._prepare_sync, data)
+        except Exception:
+            self._stats["errors"] += 1
+            return PreparedImage(data=data, ext=ext, bytes_before=len(data), bytes_after=len(data))
+        self._stats["images"] += 1
+        self._stats["kept_original"] += prepared.kept_original
+        self._stats["bytes_before"] += prepared.bytes_before
+        self._stats["bytes_after"] += prepared.bytes_after
+        return prepared
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,102 @@
+import hmac
+import time
+from typing import Optional, Dict, Any, Sequence
+
+from aiogram import Bot
+from aiohttp import web
+from loguru import logger
+
+CALLBACK_PATH = "/kie/callback"
+
+
+def callback_to_status_data(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Приводит тело колбэка kie.ai к формату data из record-info, который понимает обработчик результата.
+    В колбэке нет времени завершения — за него берём момент прихода колбэка (completeTime, мс).
+    """
+    data = payload.get("data") or {}
+    code = payload.get("code")
+    info = data.get("info") or {}
+    complete_time = int(time.time() * 1000)
+    if code == 200 and info.get("resultUrls"):
+        return {
+            "taskId": data.get("taskId"),
+            "errorCode": None,
+            "errorMessage": None,
+            "response": {"resultUrls": info["resultUrls"]},
+            "completeTime": complete_time,
+        }
+    return {
+        "taskId": data.get("taskId"),
+        "errorCode": code or 500,
+        "errorMessage": payload.get("msg") or "Unknown error",
+        "response": None,
+        "completeTime": complete_time,
+    }
+
+
+def create_kie_webhook_app(bot: Bot, secret: str, admin_ids: Sequence[int] = ()) -> web.Application:
+    """
+    aiohttp-приложение, принимающее колбэки kie.ai о завершении задач генерации.
+    """
+    # Импорт внутри: модуль задач требует настроенного Django
+    from admin_panel.telebot.models import VideoGeneration
+    from tgbot.misc.tasks import schedule_delivery
+    from tgbot.models.db_commands import AsyncDatabaseOperations, bind_submitted_task
+
+    async def kie_callback(request: web.Request) -> web.Response:
+        token = request.query.get("token", "")
+        if not secret or not hmac.compare_digest(token, secret):
+            return web.json_response({"ok": False, "error": "forbidden"}, status=403)
+        try:
+            payload = await request.json()
+        except Exception:
+            return web.json_response({"ok": False, "error": "bad json"}, status=400)
+
+        data = callback_to_status_data(payload)
+        task_id = data.get("taskId")
+        if not task_id:
+            return web.json_response({"ok": False, "error": "no taskId"}, status=400)
+
+        video = await AsyncDatabaseOperations.get_object_or_none(VideoGeneration, task_id=task_id)
+        if video is not None and video.status != "in_progress":
+            # Повторный или запоздавший колбэк: результат уже обработан, повторять отправку не нужно
+            logger.info(f"kie.ai callback for finished task {task_id} ({video.status}) ignored")
+            return web.json_response({"ok": True})
+        request_key = request.query.get("rk")
+        if video is None and request_key:
+            # Ответ на запуск не дошёл (таймаут), задача ждёт в submitting — связываем по ключу запроса
+            video = await bind_submitted_task(request_key, task_id)
+            if video is not None:
+                logger.info(f"kie.ai task {task_id} matched to submission {request_key}")
+        if video is None:
+            logger.warning(f"kie.ai callback for unknown task {task_id}")
+            return web.json_response({"ok": False, "error": "unknown task"}, status=404)
+
+        schedule_delivery(bot, video, data, admin_ids)
+        logger.info(f"kie.ai callback accepted for task {task_id}")
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.router.add_post(CALLBACK_PATH, kie_callback)
+    return app
+
+
+class KieWebhookServer:
+    def __init__(self, bot: Bot, host: str, port: int, secret: str, admin_ids: Sequence[int] = ()):
+        self.app = create_kie_webhook_app(bot, secret, admin_ids)
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info(f"kie.ai webhook listening on {self.host}:{self.port}{CALLBACK_PATH}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
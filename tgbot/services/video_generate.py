@@ -1,35 +1,236 @@
 from typing import Union, Optional, Dict, Any
 
-import aiohttp
+import asyncio
 import base64
+import hashlib
+import io
+import time
 import uuid
 import os
 
+import aiohttp
+
 from loguru import logger
+from yarl import URL
 
+from tgbot.misc.cache import TTLCache
+from tgbot.misc.latency import RollingPercentiles
+from tgbot.misc.prompt_index import PromptIndex
+from tgbot.misc.prompt_template import DEFAULT_TEMPLATE
+from tgbot.misc.resilience import CircuitBreaker, TokenBucket
 from tgbot.services.gemeni_prompt import GeminiPromptService
+from tgbot.services.http_pool import PooledHTTPClient
+
+
+# kie.ai удаляет загруженные файлы через 3 дня; держим ссылку в кэше чуть меньше
+UPLOAD_CACHE_TTL = 3 * 24 * 3600 - 3600
+MAX_VIDEOS_PER_ORDER = 3
+
+# Таймауты по операциям: зависший запрос не должен держать обработчик или цикл опроса
+DEFAULT_TIMEOUTS = {
+    "upload": aiohttp.ClientTimeout(total=120, connect=10, sock_read=60),
+    "generate": aiohttp.ClientTimeout(total=30, connect=10, sock_read=25),
+    "status": aiohttp.ClientTimeout(total=15, connect=5, sock_read=10),
+}
+# Дублирующий запрос статуса отправляется, только когда p95 посчитан хотя бы по стольким замерам
+HEDGE_MIN_SAMPLES = 20
+
+
+# Ответы, которыми kie.ai явно отклонил запрос (задача точно не создана)
+KIE_REJECT_STATUSES = (429, 503)
+
+
+class KieUnavailableError(RuntimeError):
+    """
+    kie.ai ответил 5xx/429 — считается отказом сервиса для предохранителя.
+    """
+
+    def __init__(self, message: str, status: int):
+        self.status = status
+        super().__init__(message)
+
+    @property
+    def rejected(self) -> bool:
+        return self.status in KIE_REJECT_STATUSES
 
 
 class VideoGeneratorService:
-    def __init__(self, prompt_file: str, prompt_api_key: str, video_api_token: str):
-        self.prompt_service = GeminiPromptService(prompt_file, prompt_api_key)
+    def __init__(
+            self,
+            prompt_file: str,
+            prompt_api_key: str,
+            video_api_token: str,
+            pool_limit: int = 100,
+            pool_limit_per_host: int = 20,
+            api_base: str = "https://api.kie.ai",
+            upload_base: str = "https://kieai.redpandaai.co",
+            callback_url: Optional[str] = None,
+            upload_cache_size: int = 1024,
+            upload_mode: str = "stream",
+            generate_limiter=None,
+            status_limiter=None,
+            breaker: Optional[CircuitBreaker] = None,
+            timeouts: Optional[Dict[str, aiohttp.ClientTimeout]] = None,
+            hedge_status: bool = False,
+            prompt_index: Optional[PromptIndex] = None,
+            prompt_templates: Optional[Dict[str, str]] = None,
+            template_check_interval: float = 5,
+    ):
+        self.prompt_service = GeminiPromptService(
+            prompt_file,
+            prompt_api_key,
+            index=prompt_index,
+            templates=prompt_templates,
+            template_check_interval=template_check_interval,
+        )
         self.video_api_token = video_api_token
-        self.generate_url = "https://api.kie.ai/api/v1/veo/generate"
-        self.status_url = "https://api.kie.ai/api/v1/veo/record-info"
-        self.upload_url = "https://kieai.redpandaai.co/api/file-base64-upload"
+        api_base = api_base.rstrip("/")
+        upload_base = upload_base.rstrip("/")
+        self.generate_url = f"{api_base}/api/v1/veo/generate"
+        self.status_url = f"{api_base}/api/v1/veo/record-info"
+        self.upload_url = f"{upload_base}/api/file-base64-upload"
+        self.stream_upload_url = f"{upload_base}/api/file-stream-upload"
+        # stream — multipart прямо из буфера; base64 — старый JSON-путь, он же запасной
+        self.upload_mode = upload_mode
+        self.upload_stats = {
+            "stream": {"uploads": 0, "bytes_sent": 0, "errors": 0},
+            "base64": {"uploads": 0, "bytes_sent": 0, "errors": 0},
+        }
+        # Куда kie.ai присылает результат; без него завершение узнаём только опросом
+        self.callback_url = callback_url
+        self.http = PooledHTTPClient(limit=pool_limit, limit_per_host=pool_limit_per_host)
+        # sha256 содержимого -> downloadUrl на kie.ai: одно изображение загружается один раз
+        self.upload_cache = TTLCache(maxsize=upload_cache_size, ttl=UPLOAD_CACHE_TTL)
+        self._pending_uploads: Dict[str, asyncio.Task] = {}
+        # Отдельные бюджеты: фоновый опрос статусов не должен тормозить запуск генераций
+        self.generate_limiter = generate_limiter or TokenBucket(rate=2, capacity=20)
+        self.status_limiter = status_limiter or TokenBucket(rate=10, capacity=20)
+        self.breaker = breaker or CircuitBreaker("kie.ai")
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        # Задержки успешных запросов по операциям (upload/generate/status)
+        self.latency = RollingPercentiles(window=500)
+        self.hedge_status = hedge_status
+        self.hedge_stats = {"hedged": 0, "hedge_won": 0}
+
+    async def start(self) -> None:
+        await self.http.start()
+
+    async def close(self) -> None:
+        await self.http.close()
+
+    def pool_stats(self) -> Dict[str, Any]:
+        return self.http.stats()
+
+    async def _call_kie(self, limiter, func, *args):
+        """
+        Вызов kie.ai через ограничитель частоты и предохранитель.
+        Сетевые ошибки, таймауты и 5xx/429 размыкают цепь; прочие ответы означают, что сервис жив.
+        """
+        self.breaker.before_call()
+        try:
+            if limiter is not None:
+                await limiter.acquire()
+            result = await func(*args)
+        except (aiohttp.ClientError, asyncio.TimeoutError, KieUnavailableError):
+            self.breaker.record_failure()
+            raise
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        return result
+
+    async def _timed(self, operation: str, coro):
+        started = time.monotonic()
+        result = await coro
+        self.latency.observe(operation, time.monotonic() - started)
+        return result
+
+    @staticmethod
+    def _check_available(response: aiohttp.ClientResponse) -> None:
+        if response.status >= 500 or response.status == 429:
+            raise KieUnavailableError(f"kie.ai unavailable: HTTP {response.status}", response.status)
+
+    @staticmethod
+    def image_key(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
 
     async def upload_image(self, data: bytes, filename: Optional[str] = None) -> str:
+        """
+        Загрузка с кэшем по хэшу содержимого. Параллельные загрузки одного файла объединяются в одну.
+        """
+        key = self.image_key(data)
+        url = self.upload_cache.get(key)
+        if url:
+            return url
+        task = self._pending_uploads.get(key)
+        if task is None:
+            task = asyncio.create_task(
+                self._call_kie(None, lambda: self._timed("upload", self._upload_and_cache(key, data, filename)))
+            )
+            self._pending_uploads[key] = task
+            task.add_done_callback(lambda _: self._pending_uploads.pop(key, None))
+        # shield: отмена одного ожидающего не должна обрывать общую загрузку
+        return await asyncio.shield(task)
+
+    async def _upload_and_cache(self, key: str, data: bytes, filename: Optional[str]) -> str:
         # Генерируем уникальное имя файла
         if not filename:
             filename = f"{uuid.uuid4().hex}.jpg"
-        ext = os.path.splitext(filename)[1] or ".jpg"
+        url = None
+        if self.upload_mode == "stream":
+            try:
+                url = await self._upload_stream(data, filename)
+            except Exception as e:
+                self.upload_stats["stream"]["errors"] += 1
+                logger.warning(f"Stream upload failed, falling back to base64: {e}")
+        if url is None:
+            try:
+                url = await self._upload_base64(data, filename)
+            except Exception:
+                self.upload_stats["base64"]["errors"] += 1
+                raise
+        self.upload_cache.set(key, url)
+        return url
 
-        file_data = base64.b64encode(data).decode("utf-8")
+    @staticmethod
+    def _image_mime(filename: str) -> str:
+        ext = os.path.splitext(filename)[1] or ".jpg"
         # Можно уточнить mime по расширению; по умолчанию jpeg
         mime = "image/jpeg"
         if ext.lower() in (".png",):
             mime = "image/png"
-        base64_data = f"data:{mime};base64,{file_data}"
+        elif ext.lower() in (".webp",):
+            mime = "image/webp"
+        return mime
+
+    async def _upload_stream(self, data: bytes, filename: str) -> str:
+        """
+        Multipart-загрузка: файл читается кусками из исходного буфера, без base64 и JSON-копий.
+        """
+        form = aiohttp.FormData()
+        form.add_field("uploadPath", "images")
+        form.add_field("fileName", filename)
+        # BytesIO поверх bytes не копирует данные, aiohttp отдаёт их в сокет частями
+        form.add_field("file", io.BytesIO(data), filename=filename, content_type=self._image_mime(filename))
+        headers = {"Authorization": f"Bearer {self.video_api_token}"}
+        session = await self.http.session()
+        async with session.post(self.stream_upload_url, data=form, headers=headers,
+                                timeout=self.timeouts["upload"]) as response:
+            self._check_available(response)
+            resp_json = await response.json()
+            if response.status != 200 or not (resp_json.get("data") or {}).get("downloadUrl"):
+                raise RuntimeError(f"Stream upload error {response.status}: {resp_json}")
+        self.upload_stats["stream"]["uploads"] += 1
+        self.upload_stats["stream"]["bytes_sent"] += len(data)
+        return resp_json["data"]["downloadUrl"]
+
+    async def _upload_base64(self, data: bytes, filename: str) -> str:
+        file_data = base64.b64encode(data).decode("utf-8")
+        base64_data = f"data:{self._image_mime(filename)};base64,{file_data}"
         payload = {
             "base64Data": base64_data,
             "uploadPath": "images",
@@ -39,10 +240,31 @@ class VideoGeneratorService:
             "Authorization": f"Bearer {self.video_api_token}",
             "Content-Type": "application/json"
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.upload_url, json=payload, headers=headers) as response:
-                data = await response.json()
-                return data["data"]["downloadUrl"]
+        session = await self.http.session()
+        async with session.post(self.upload_url, json=payload, headers=headers,
+                                timeout=self.timeouts["upload"]) as response:
+            self._check_available(response)
+            data = await response.json()
+            url = data["data"]["downloadUrl"]
+        self.upload_stats["base64"]["uploads"] += 1
+        self.upload_stats["base64"]["bytes_sent"] += len(base64_data)
+        return url
+
+    async def adapt_prompts(
+            self, prompt_user: str, count: int = 1, distinct: bool = False, template: str = DEFAULT_TEMPLATE
+    ) -> list[Optional[str]]:
+        """
+        Адаптация промпта один раз на заказ: count одинаковых копий либо count разных вариантов одним запросом.
+        template — имя шаблона промпта (см. PROMPT_TEMPLATES).
+        """
+        if distinct and count > 1:
+            # Всегда просим максимум вариантов: один и тот же запрос подходит для заказа любого размера
+            variants = await self.prompt_service.generate_variants(
+                prompt_user, max(count, MAX_VIDEOS_PER_ORDER), template
+            )
+            return variants[:count]
+        prompt = await self.prompt_service.generate(prompt_user, template)
+        return [prompt] * count
 
     async def generate_video(
             self,
@@ -51,17 +273,26 @@ class VideoGeneratorService:
             image_filename: Optional[str] = None,
             model: str = "veo3",
             aspect_ratio: str = "16:9",
-            enable_fallback: bool = False
+            enable_fallback: bool = False,
+            adapted_prompt: Optional[str] = None,
+            image_url: Optional[str] = None,
+            request_key: Optional[str] = None,
     ) -> Dict[str, Any]:
         """
         Генерация видео (максимум одно изображение).
+        adapted_prompt — уже адаптированный промпт (см. adapt_prompts), чтобы не звать LLM на каждое видео.
+        image_url — ссылка на заранее загруженное изображение; иначе загружаем image_bytes.
+        request_key — ключ идемпотентности записи: уходит в callBackUrl, по нему колбэк находит задачу,
+        даже если ответ на сам запуск потерялся.
         """
         image_urls = []
-        if image_bytes:
+        if image_url:
+            image_urls.append(image_url)
+        elif image_bytes:
             uploaded_url = await self.upload_image(image_bytes, image_filename)
             image_urls.append(uploaded_url)
 
-        prompt = await self.prompt_service.generate(prompt_user)
+        prompt = adapted_prompt or await self.prompt_service.generate(prompt_user)
         logger.info(f'Prompt before adaptation: {prompt}')
         payload = {
             "prompt": prompt,
@@ -70,20 +301,68 @@ class VideoGeneratorService:
             "aspectRatio": aspect_ratio,
             "enableFallback": enable_fallback
         }
+        if self.callback_url:
+            callback = URL(self.callback_url)
+            if request_key:
+                callback = callback.update_query(rk=request_key)
+            payload["callBackUrl"] = str(callback)
         headers = {
             "Authorization": f"Bearer {self.video_api_token}",
             "Content-Type": "application/json"
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.generate_url, json=payload, headers=headers) as response:
-                resp_json = await response.json()
-                if response.status != 200:
-                    raise RuntimeError(f"Video generate error {response.status}: {resp_json}")
-                return resp_json
-
-    async def get_video_status(self, task_id: str):
+        return await self._call_kie(
+            self.generate_limiter, lambda: self._timed("generate", self._post_generate(payload, headers))
+        )
+
+    async def _post_generate(self, payload: dict, headers: dict) -> Dict[str, Any]:
+        session = await self.http.session()
+        async with session.post(self.generate_url, json=payload, headers=headers,
+                                timeout=self.timeouts["generate"]) as response:
+            self._check_available(response)
+            resp_json = await response.json()
+            if response.status != 200:
+                raise RuntimeError(f"Video generate error {response.status}: {resp_json}")
+            return resp_json
+
+    async def get_video_status(self, task_id: str, hedge: Optional[bool] = None):
+        """
+        hedge — если первый запрос дольше наблюдаемого p95, параллельно отправить второй и взять первый ответ.
+        """
+        hedge = self.hedge_status if hedge is None else hedge
+        if hedge:
+            return await self._call_kie(self.status_limiter, lambda: self._fetch_status_hedged(task_id))
+        return await self._call_kie(self.status_limiter, lambda: self._timed("status", self._fetch_status(task_id)))
+
+    async def _fetch_status_hedged(self, task_id: str):
+        delay = self.latency.percentile("status", 0.95)
+        if delay is None or self.latency.count("status") < HEDGE_MIN_SAMPLES:
+            return await self._timed("status", self._fetch_status(task_id))
+        primary = asyncio.create_task(self._timed("status", self._fetch_status(task_id)))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                await self.status_limiter.acquire()
+                self.hedge_stats["hedged"] += 1
+                tasks.add(asyncio.create_task(self._timed("status", self._fetch_status(task_id))))
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_stats["hedge_won"] += 1
+                        return task.result()
+            # Оба запроса упали — отдаём ошибку основного
+            return primary.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _fetch_status(self, task_id: str):
         headers = {"Authorization": f"Bearer {self.video_api_token}"}
         params = {"taskId": task_id}
-        async with aiohttp.ClientSession() as session:
-            async with session.get(self.status_url, headers=headers, params=params) as response:
-                return await response.json()
+        session = await self.http.session()
+        async with session.get(self.status_url, headers=headers, params=params,
+                               timeout=self.timeouts["status"]) as response:
+            self._check_available(response)
+            return await response.json()